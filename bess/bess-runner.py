@@ -30,6 +30,10 @@ import sys
 import time
 from pathlib import Path
 
+tipsy_lib = Path(__file__).resolve().parent.parent / 'lib'
+sys.path.insert(0, str(tipsy_lib))
+import conf_tables
+
 
 class BessUpdater(object):
     def __init__(self, conf):
@@ -37,6 +41,7 @@ class BessUpdater(object):
         self.conf = conf
         self.runtime_interval = 1
         self._running = False
+        self._reset = False
         self.workers_num = self.get_num_workers()
 
     def get_local_bess_handle(self):
@@ -57,19 +62,32 @@ class BessUpdater(object):
     def stop(self):
         self._running = False
 
+    def reset(self):
+        "Restart the run-time tasks for the next measurement"
+        self._reset = True
+
+    def handle_reset(self):
+        """Called between the rounds of the run-time tasks: if a reset
+        has been requested, the next round starts the run-time tasks of
+        the next measurement (warm-SUT mode)"""
+        if self._reset:
+            self._reset = False
+            call_configured_webhook()
+
     def _run(self):
         actions = ('add', 'del')
         targets = ('user', 'server')
         tasks = ['_'.join(e) for e in itertools.product(actions, targets)]
         table_actions = ('mod_table', 'mod_l3_table', 'mod_group_table')
         while self._running:
+            self.handle_reset()
             for task in self.conf.run_time:
                 if not self._running:
                     return
                 if task.action == 'handover':
                     teid = task.args.user_teid
                     shift = task.args.bst_shift
-                    user = [u for u in self.conf.users if u.teid == teid][0]
+                    user = self.find_user(teid)
                     new_bst = self._calc_new_bst_id(user.tun_end, shift)
                     self.handover(user, new_bst)
                 elif task.action in table_actions:
@@ -79,6 +97,13 @@ class BessUpdater(object):
                     getattr(self, task.action)(task.args)
             time.sleep(self.runtime_interval)
 
+    def find_user(self, teid):
+        users = self.conf.users
+        if isinstance(users, conf_tables.Table):
+            # Search the column instead of creating all the rows
+            return users[(users.column('teid') == teid).nonzero()[0][0]]
+        return [u for u in users if u.teid == teid][0]
+
     def _calc_new_bst_id(self, cur_bst_id, bst_shift):
         return (cur_bst_id + bst_shift) % len(self.conf.bsts)
 
@@ -104,6 +129,7 @@ class BessUpdater(object):
 class BessUpdaterDummy(BessUpdater):
     def _run(self):
         while self._running:
+            self.handle_reset()
             time.sleep(self.runtime_interval)
 
 
@@ -163,7 +189,7 @@ class BessUpdaterL3Fwd(BessUpdater):
                 self.bess.pause_worker(wid)
                 self.bess.pause_worker(wid2)
                 name = 'l3fib_%s_%d' % (table[0], wid)
-                ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+                ip = conf_tables.ip_prefix(entry.ip, entry.prefix_len)
                 gat = entry.nhop + 1
                 if cmd == 'add':
                     self.bess.run_module_command(name,
@@ -359,6 +385,18 @@ def signal_handler(signum, frame):
     updater.stop()
 
 
+def reset_handler(signum, frame):
+    updater.reset()
+
+
+def call_configured_webhook():
+    try:
+        url = 'http://localhost:9000/configured'
+        requests.get(url)
+    except requests.ConnectionError:
+        pass
+
+
 def call_cmd(cmd):
     print(' '.join(cmd))
     return subprocess.call(cmd)
@@ -388,7 +426,7 @@ if __name__ == '__main__':
 
     try:
         def conv_fn(d): return ObjectView(**d)
-        pl_config = json.load(args.pl_conf, object_hook=conv_fn)
+        pl_config = conf_tables.load(args.pl_conf, object_hook=conv_fn)
         bm_config = json.load(args.bm_conf, object_hook=conv_fn)
     except:
         raise
@@ -399,14 +437,10 @@ if __name__ == '__main__':
                       'daemon', 'start', '--',
                       'run', 'file',
                       pipeline_bess,
-                      'pl_config=\"%s\",bm_config=\"%s\"' %
-                      (args.pl_conf.name, args.bm_conf.name)]
+                      'pl_config=\"%s\",bm_config=\"%s\",tipsy_lib=\"%s\"' %
+                      (args.pl_conf.name, args.bm_conf.name, tipsy_lib)]
     ret_val = call_cmd(bess_start_cmd)
-    try:
-        url = 'http://localhost:9000/configured'
-        requests.get(url)
-    except requests.ConnectionError:
-        pass
+    call_configured_webhook()
     if not ret_val:
 
         try:
@@ -417,6 +451,7 @@ if __name__ == '__main__':
             updater = BessUpdaterDummy(pl_config)
 
         signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGUSR1, reset_handler)
 
         updater.start()
 
@@ -36,6 +36,13 @@ def check_type_boolean (string):
 def check_type_number (string):
   return float(string)
 
+def check_type_integer (string):
+  msg = "'%s' is not an integer" % string
+  try:
+    return int(string)
+  except ValueError:
+    raise argparse.ArgumentTypeError(msg)
+
 def check_type_positive_integer (string):
   msg = "'%s' is not a positive integer" % string
   try:
@@ -56,6 +63,12 @@ def check_type_non_negative_integer (string):
     raise argparse.ArgumentTypeError(msg)
   return i
 
+def check_type_pkt_size (string):
+  "A packet size or the description of a packet size distribution"
+  if re.match(r'^[0-9]+$', string):
+    return check_type_positive_integer(string)
+  return string
+
 def check_type_readable_file (string):
   return argparse.FileType('r')(string)
 
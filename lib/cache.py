@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Content-addressed cache of generated files (pipeline.json,
+traffic.pcap) shared by the measurement directories.
+
+An entry is keyed by the hash of the normalized input files and of the
+TIPSY sources generating the outputs.  Cached outputs are reflinked
+(or copied, if the file system does not support reflinks) into the
+measurement directories.  They are never hardlinked: make(1) compares
+the mtimes of the files, so the directories must not share inodes with
+each other or with the cache.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import find_mod
+except ImportError:
+    from . import find_mod
+
+__all__ = ["Cache"]
+
+def normalize(fname, ignored_keys=()):
+    "Return the content of `fname` in a canonical form"
+    with open(fname, 'rb') as f:
+        content = f.read()
+    try:
+        data = json.loads(content.decode())
+    except ValueError:
+        return content
+    if isinstance(data, dict):
+        for key in ignored_keys:
+            data.pop(key, None)
+    return json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+
+sources_digest = None
+def get_sources_digest():
+    "Hash of the TIPSY sources the generated files depend on"
+    global sources_digest
+    if sources_digest:
+        return sources_digest
+    root = Path(__file__).resolve().parent.parent
+    files = list(root.glob('lib/gen_*.py')) + list(root.glob('schema/*.json'))
+    files += [root / 'lib' / 'args_from_schema.py']
+    for pattern in ['GenConf_*.py', 'GenPkt_*.py', 'pipeline-*.json']:
+        files += [Path(f) for f in find_mod.glob(pattern)]
+    h = hashlib.sha256()
+    for f in sorted(set(files)):
+        h.update(str(f.relative_to(root)).encode())
+        h.update(f.read_bytes())
+    sources_digest = h.hexdigest()
+    return sources_digest
+
+def parse_size(string):
+    "'10G' -> 10737418240"
+    m = re.match(r'^(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)[bB]?$', string)
+    if not m:
+        raise argparse.ArgumentTypeError("'%s' is not a size" % string)
+    exp = ' kmgt'.index(m.group(2).lower() or ' ')
+    return int(float(m.group(1)) * 1024 ** exp)
+
+def format_size(size):
+    for unit in ['B', 'KiB', 'MiB', 'GiB']:
+        if size < 1024:
+            return '%.1f%s' % (size, unit)
+        size /= 1024
+    return '%.1fTiB' % size
+
+def copy_file(src, dst):
+    "Reflink `src` to `dst`, fall back to a copy"
+    src, dst = str(src), str(dst)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    r = subprocess.run(['cp', '--reflink=auto', '--no-preserve=mode',
+                        src, dst], stderr=subprocess.DEVNULL)
+    if r.returncode != 0:
+        shutil.copyfile(src, dst)
+
+
+class Cache(object):
+    def __init__(self, cache_dir):
+        self.dir = Path(cache_dir)
+
+    def key(self, inputs, ignored_keys=()):
+        h = hashlib.sha256()
+        h.update(get_sources_digest().encode())
+        for fname in inputs:
+            # Optional inputs (e.g., the columnar sidecar of a pipeline
+            # config) might be missing
+            if os.path.exists(fname):
+                h.update(normalize(fname, ignored_keys))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _meta_file(self, key):
+        return self.dir / key / 'meta.json'
+
+    def _read_meta(self, key):
+        with self._meta_file(key).open() as f:
+            return json.load(f)
+
+    def _write_meta(self, key, meta):
+        # Concurrent restores of the same entry need their own tmp files
+        meta_file = self._meta_file(key)
+        with tempfile.NamedTemporaryFile('w', dir=str(meta_file.parent),
+                                         prefix='.meta-', delete=False) as f:
+            json.dump(meta, f, indent=4, sort_keys=True)
+        os.rename(f.name, str(meta_file))
+
+    def restore(self, key, out_dir='.'):
+        """Copy the cached files of entry `key` into `out_dir`.  Return
+        the list of the restored files, or None if the entry does not
+        exist."""
+        try:
+            meta = self._read_meta(key)
+        except (OSError, ValueError):
+            return None
+        for fname in meta['files']:
+            dst = Path(out_dir) / fname
+            copy_file(self.dir / key / fname, dst)
+            os.utime(str(dst))  # make(1) compares mtimes
+        meta['last-used'] = time.time()
+        meta['hits'] = meta.get('hits', 0) + 1
+        self._write_meta(key, meta)
+        return meta['files']
+
+    def store(self, key, files, inputs=()):
+        "Add the existing ones of `files` to the cache as entry `key`"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=str(self.dir), prefix='.tmp-'))
+        stored, size = [], 0
+        for fname in files:
+            if not Path(fname).is_file():
+                continue
+            dst = tmp_dir / Path(fname).name
+            copy_file(fname, dst)
+            dst.chmod(0o444)
+            stored.append(dst.name)
+            size += dst.stat().st_size
+        now = time.time()
+        meta = {'files': stored, 'size': size, 'created': now,
+                'last-used': now, 'hits': 0,
+                'inputs': [str(Path(i).resolve()) for i in inputs]}
+        with (tmp_dir / 'meta.json').open('w') as f:
+            json.dump(meta, f, indent=4, sort_keys=True)
+        try:
+            tmp_dir.rename(self.dir / key)
+        except OSError:
+            # A concurrent process has already stored the same entry.
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+
+    def run(self, cmd, inputs, outputs, ignored_keys=()):
+        "Restore `outputs` from the cache or generate them with `cmd`"
+        key = self.key(inputs, ignored_keys)
+        files = self.restore(key)
+        if files is not None:
+            print('%s: restored from cache (%s)' % (', '.join(files), key[:12]))
+            return 0
+        for fname in outputs:
+            # The old outputs might be hardlinks to cache entries
+            # (restored by earlier versions of TIPSY).
+            if os.path.lexists(fname):
+                os.unlink(fname)
+        r = subprocess.run(cmd)
+        if r.returncode == 0:
+            self.store(key, outputs, inputs)
+        return r.returncode
+
+    def entries(self):
+        "Return the list of (key, meta) of the entries, oldest use first"
+        ret = []
+        if not self.dir.is_dir():
+            return ret
+        for d in self.dir.iterdir():
+            if d.name.startswith('.'):
+                continue
+            try:
+                ret.append((d.name, self._read_meta(d.name)))
+            except (OSError, ValueError):
+                continue
+        ret.sort(key=lambda x: x[1]['last-used'])
+        return ret
+
+    def remove(self, key):
+        shutil.rmtree(str(self.dir / key), ignore_errors=True)
+
+    def prune(self, max_size=None, max_age=None):
+        """Remove entries not used for `max_age` seconds, then the least
+        recently used ones until the total size is below `max_size`.
+        Return the list of removed keys."""
+        removed = []
+        entries = self.entries()
+        now = time.time()
+        if max_age is not None:
+            for key, meta in entries:
+                if now - meta['last-used'] > max_age:
+                    self.remove(key)
+                    removed.append(key)
+        entries = [e for e in entries if e[0] not in removed]
+        total = sum(meta['size'] for _, meta in entries)
+        for key, meta in entries:
+            if max_size is None or total <= max_size:
+                break
+            self.remove(key)
+            removed.append(key)
+            total -= meta['size']
+        return removed
+
+    def clear(self):
+        shutil.rmtree(str(self.dir), ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Generate files with a command unless they are cached',
+        usage='%(prog)s run --cache-dir DIR [-i IN]... -o OUT... -- CMD...')
+    parser.add_argument('action', choices=['run'])
+    parser.add_argument('--cache-dir', '-c', required=True,
+                        help='Cache directory')
+    parser.add_argument('--input', '-i', action='append', default=[],
+                        help='Input file of the command')
+    parser.add_argument('--output', '-o', action='append', default=[],
+                        help='Output file of the command')
+    parser.add_argument('--ignore-key', action='append', default=[],
+                        help='JSON property of the inputs that does not '
+                        'affect the outputs')
+    argv = sys.argv[1:]
+    if '--' not in argv:
+        parser.error('the command must follow a "--" argument')
+    sep = argv.index('--')
+    args = parser.parse_args(argv[:sep])
+    args.cmd = argv[sep + 1:]
+    if not args.cmd or not args.output:
+        parser.error('the command and its outputs must be specified')
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = Cache(args.cache_dir)
+    sys.exit(cache.run(args.cmd, args.input, args.output, args.ignore_key))
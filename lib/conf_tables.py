@@ -0,0 +1,286 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Columnar storage of the big tables of pipeline configs.
+
+gen_conf can move the tables of a pipeline config (lists of flat
+objects with the same keys: users, servers, L2/L3 tables, etc.) to an
+uncompressed .npz sidecar next to the config (<config>.tables.npz).
+In the config, such a table is replaced by a reference:
+
+  "users": {"columnar-table": "pipeline.json.tables.npz",
+            "name": "users", "length": 1000000,
+            "columns": [["ip", "ip"], ["teid", "int"],
+                        ["rate_limit", "const", 10000], ...]}
+
+Column types: int (int64), bool, ip (IPv4 addresses as uint32), mac
+(MAC addresses as uint64), str (ASCII bytes), and const: the same
+value in every row, stored in the reference only.
+
+load() is a drop-in replacement of json.load() that turns the
+references into Table objects: read-only sequences that create the
+rows on access from memory mapped columns.  Only the accessed rows are
+parsed, and Table.column() returns a whole column as a numpy array
+without creating any rows.  numpy is needed only for configs with
+columnar tables.  This module is also used on the SUT, so it works
+with python2, too.
+"""
+
+import json
+import os
+import socket
+import struct
+import zipfile
+
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence
+
+__all__ = ['load', 'store_tables', 'sidecar_fname', 'Table', 'ip2int',
+           'int2ip', 'mac2int', 'int2mac', 'ip_prefix']
+
+SUFFIX = '.tables.npz'
+
+
+def sidecar_fname(fname):
+    "Columnar sidecar of config file `fname`"
+    return str(fname) + SUFFIX
+
+def ip2int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def int2ip(value):
+    return socket.inet_ntoa(struct.pack('!I', int(value)))
+
+def mac2int(mac):
+    return int(mac.replace(':', ''), 16)
+
+def int2mac(value):
+    return ':'.join('%02x' % b for b in bytearray(struct.pack('!Q', int(value))[2:]))
+
+def ip_prefix(ip, prefix_len):
+    "Network address of `ip`/`prefix_len`"
+    mask = (0xffffffff << (32 - prefix_len)) & 0xffffffff
+    return int2ip(ip2int(ip) & mask)
+
+
+def encode_column(values):
+    """Return the (type, array) of a column, None if it cannot be stored
+    in columnar form"""
+    import numpy as np
+
+    first = values[0]
+    if isinstance(first, (dict, list)):
+        return None
+    if all(v == first and type(v) == type(first) for v in values):
+        return 'const', None
+    if all(type(v) == bool for v in values):
+        return 'bool', np.array(values, dtype=bool)
+    if all(type(v) == int for v in values):
+        if -2**63 <= min(values) and max(values) < 2**63:
+            return 'int', np.array(values, dtype=np.int64)
+        return None
+    if not all(isinstance(v, str) for v in values):
+        return None
+    for typ, enc, dec, dtype in [('ip', ip2int, int2ip, np.uint32),
+                                 ('mac', mac2int, int2mac, np.uint64)]:
+        try:
+            ints = [enc(v) for v in values]
+        except (OSError, ValueError):
+            continue
+        # Store only if the strings can be restored exactly
+        if all(dec(i) == v for i, v in zip(ints, values)):
+            return typ, np.array(ints, dtype=dtype)
+    try:
+        return 'str', np.array([v.encode('ascii') for v in values])
+    except UnicodeEncodeError:
+        return None
+
+def encode_table(rows):
+    """Return the columns of `rows` as (name, type, array) tuples, None
+    if `rows` is not a table of flat objects with the same keys"""
+    if not all(isinstance(r, dict) for r in rows):
+        return None
+    keys = set(rows[0])
+    if any(set(r) != keys for r in rows):
+        return None
+    columns = []
+    for key in sorted(keys):
+        col = encode_column([r[key] for r in rows])
+        if col is None:
+            return None
+        columns.append((key,) + col)
+    return columns
+
+def store_tables(conf, fname, min_size):
+    """Move the tables of `conf` with at least `min_size` rows to the
+    sidecar of config file `fname`, return the config referring to
+    them"""
+    import numpy as np
+
+    sidecar = sidecar_fname(fname)
+    arrays = {}
+    new_conf = dict(conf)
+    for name, table in conf.items():
+        if not isinstance(table, list) or len(table) < max(min_size, 1):
+            continue
+        columns = encode_table(table)
+        if columns is None:
+            continue
+        ref_columns = []
+        for col, typ, array in columns:
+            if typ == 'const':
+                ref_columns.append([col, typ, table[0][col]])
+            else:
+                ref_columns.append([col, typ])
+                arrays['%s.%s' % (name, col)] = array
+        new_conf[name] = {
+            'columnar-table': os.path.basename(sidecar),
+            'name': name,
+            'length': len(table),
+            'columns': ref_columns,
+        }
+    if arrays:
+        # np.savez does not compress, so the arrays can be memory mapped
+        with open(sidecar, 'wb') as f:
+            np.savez(f, **arrays)
+    elif os.path.exists(sidecar):
+        os.unlink(sidecar)
+    return new_conf
+
+
+def map_npz(fname):
+    "Memory map the arrays of an uncompressed .npz file"
+    import numpy as np
+    fmt = np.lib.format
+
+    arrays = {}
+    with zipfile.ZipFile(fname) as z, open(fname, 'rb') as f:
+        for info in z.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('%s: compressed member: %s' %
+                                 (fname, info.filename))
+            # Skip the local file header
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = fmt.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = fmt.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = fmt.read_array_header_2_0(f)
+            arrays[info.filename[:-len('.npy')]] = np.memmap(
+                fname, dtype=dtype, mode='r', shape=shape, offset=f.tell(),
+                order='F' if fortran else 'C')
+    return arrays
+
+
+class Table(Sequence):
+    """A table of a pipeline config stored in columnar form.
+
+    The rows are dicts (or whatever `row_hook` makes of them) created on
+    access, so modifications of a row are kept only if the row is
+    assigned back to the table: table[i] = row.
+    """
+
+    def __init__(self, fname, ref, row_hook=None):
+        self.fname = fname
+        self.name = ref['name']
+        self.length = ref['length']
+        self.columns = [c[0] for c in ref['columns']]
+        self.types = dict((c[0], c[1]) for c in ref['columns'])
+        self.consts = dict((c[0], c[2]) for c in ref['columns']
+                           if c[1] == 'const')
+        self.row_hook = row_hook
+        self.modified_rows = {}
+        self._arrays = None
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return '<Table %s: %d rows of %s>' % (self.name, self.length,
+                                              ', '.join(self.columns))
+
+    def arrays(self):
+        if self._arrays is None:
+            prefix = self.name + '.'
+            self._arrays = dict((k[len(prefix):], v)
+                                for k, v in map_npz(self.fname).items()
+                                if k.startswith(prefix))
+        return self._arrays
+
+    def column(self, name):
+        """Return column `name` as a numpy array: IPv4 and MAC addresses
+        as integers, strings as bytes"""
+        import numpy as np
+
+        if name in self.consts:
+            value = np.asarray(self.consts[name])
+            return np.broadcast_to(value, (self.length,))
+        return self.arrays()[name]
+
+    def get_value(self, name, idx):
+        typ = self.types[name]
+        if typ == 'const':
+            return self.consts[name]
+        value = self.arrays()[name][idx]
+        if typ == 'ip':
+            return int2ip(value)
+        if typ == 'mac':
+            return int2mac(value)
+        if typ == 'str':
+            return value.decode('ascii')
+        return value.item()
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.length))]
+        idx = self.index_of(idx)
+        if idx in self.modified_rows:
+            return self.modified_rows[idx]
+        row = dict((c, self.get_value(c, idx)) for c in self.columns)
+        if self.row_hook:
+            row = self.row_hook(row)
+        return row
+
+    def __setitem__(self, idx, row):
+        self.modified_rows[self.index_of(idx)] = row
+
+    def index_of(self, idx):
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError('table index out of range')
+        return idx
+
+
+def load(f, object_hook=None):
+    """Load a pipeline config from file object `f` like json.load(), but
+    replace the references to columnar tables with Table objects"""
+    base_dir = os.path.dirname(getattr(f, 'name', '')) or '.'
+
+    def hook(d):
+        if 'columnar-table' in d:
+            fname = os.path.join(base_dir, d['columnar-table'])
+            return Table(fname, d, object_hook)
+        if object_hook:
+            return object_hook(d)
+        return d
+
+    return json.load(f, object_hook=hook)
@@ -24,12 +24,16 @@ from pathlib import Path
 
 try:
   import args_from_schema
+  import conf_tables
   import find_mod
-  from gen_conf_base import GenConf, byte_seq
+  from gen_conf_base import GenConf, RunTime, byte_seq
+  from gen_lpm import parse_prefix_len_dist
 except ImportError:
   from . import args_from_schema
+  from . import conf_tables
   from . import find_mod
-  from .gen_conf_base import GenConf, byte_seq
+  from .gen_conf_base import GenConf, RunTime, byte_seq
+  from .gen_lpm import parse_prefix_len_dist
 
 __all__ = ["gen_conf"]
 
@@ -120,19 +124,22 @@ class GenConf_l2fwd (GenConf):
     d_entries = fluct - u_entries
 
     def make_rule (op, entry, tbl):
-      return [{
+      return {
         'action': 'mod_table',
         'cmd': op,
         'entry': entry,
         'table': tbl,
-      }]
-    rules = []
+      }
+    rules = RunTime()
     directions = ['upstream'] * u_entries + ['downstream'] * d_entries
     entries = make_tbl(fluct, 'aa:bb:bb:aa:%02x:%02x')
     for entry, d in zip(entries, directions):
-      rules = make_rule('add', entry, d) + rules + make_rule('del', entry, d)
-    self.conf['run_time'] += rules
+      rules.wrap([make_rule('add', entry, d)], [make_rule('del', entry, d)])
+    self.run_time.extend(rules)
+
 
+# First octets of the generated l3fwd routes (but the sequential ones)
+LPM_OCTETS = {'upstream': range(1, 127), 'downstream': range(128, 224)}
 
 class GenConf_l3fwd (GenConf):
   "L3 Packet Forwarding pipeline"
@@ -143,13 +150,37 @@ class GenConf_l3fwd (GenConf):
     self.components += ['l3', 'sut_mac_addresses']
 
   def add_l3 (self):
+    dist = parse_prefix_len_dist(self.args.l3_prefix_len)
+    nesting = self.args.l3_prefix_nesting
+    # The original table: sequential /24 routes
+    sequential = list(dist) == [24] and nesting == 0
+
+    uts = self.args.upstream_l3_table_size
+    dts = self.args.downstream_l3_table_size
+    fluct = self.args.fluct_l3_table
+    u_servers = int(fluct * uts / (uts + dts))
+    extra_size = {'upstream': u_servers, 'downstream': (fluct - u_servers)}
+    extra_tables = {}
     for i, d in enumerate(['upstream', 'downstream']):
-      self.conf['%s_l3_table' % d] = self.create_l3_table(
-        size=self.get_arg('%s_l3_table_size' % d),
-        nhops=self.get_arg('%s_group_table_size' % d),
-        addr_template='%d.%d.%d.2',
-        offset_first=50+i*100
-      )
+      size = self.get_arg('%s_l3_table_size' % d)
+      nhops = self.get_arg('%s_group_table_size' % d)
+      if sequential:
+        table = self.create_l3_table(
+          size=size,
+          nhops=nhops,
+          addr_template='%d.%d.%d.2',
+          offset_first=50+i*100
+        )
+        extra_tables[d] = self.create_l3_table(
+          size=extra_size[d],
+          nhops=nhops,
+          addr_template='%d.%d.%d.2',
+          offset_first=1+i*20
+        )
+      else:
+        table, extra_tables[d] = self.create_lpm_table(
+          size, nhops, dist, nesting, LPM_OCTETS[d], extra=extra_size[d])
+      self.conf['%s_l3_table' % d] = table
 
     for d in ['upstream', 'downstream']:
       dprefix = {'upstream': 'aa:bb:bb:aa', 'downstream': 'aa:aa:ab:ba'}[d]
@@ -165,22 +196,11 @@ class GenConf_l3fwd (GenConf):
       return {'action': action, 'cmd': op, 'entry': entry, 'table': tbl}
     action = 'mod_l3_table'
     add_rules, del_rules  = [], []
-    for i, d in enumerate(['upstream', 'downstream']):
-      uts = self.args.upstream_l3_table_size
-      dts = self.args.downstream_l3_table_size
-      fluct = self.args.fluct_l3_table
-      u_servers = int(fluct * uts / (uts + dts))
-      size = {'upstream': u_servers, 'downstream': (fluct - u_servers)}[d]
-      temp_table = self.create_l3_table(
-        size=size,
-        nhops=self.get_arg('%s_group_table_size' % d),
-        addr_template='%d.%d.%d.2',
-        offset_first=1+i*20
-      )
-      for entry in temp_table:
-        add_rules = add_rules + [make_rule('add', entry, d)]
-        del_rules = [make_rule('del', entry, d)] + del_rules
-    self.conf['run_time'] = add_rules + self.conf['run_time'] + del_rules
+    for d in ['upstream', 'downstream']:
+      for entry in extra_tables[d]:
+        add_rules.append(make_rule('add', entry, d))
+        del_rules.append(make_rule('del', entry, d))
+    self.run_time.wrap(add_rules, reversed(del_rules))
 
     action = 'mod_group_table'
     add_rules, del_rules = [], []
@@ -197,9 +217,9 @@ class GenConf_l3fwd (GenConf):
         smac_template='%s:%%02x:%%02x' % sprefix
       )
       for entry in extra_nhops:
-        add_rules = add_rules + [make_rule('add', entry, d)]
-        del_rules = [make_rule('del', entry, d)] + del_rules
-    self.conf['run_time'] = add_rules + self.conf['run_time'] + del_rules
+        add_rules.append(make_rule('add', entry, d))
+        del_rules.append(make_rule('del', entry, d))
+    self.run_time.wrap(add_rules, reversed(del_rules))
 
 
 class GenConf_mgw (GenConf):
@@ -222,7 +242,7 @@ class GenConf_mgw (GenConf):
                          'bst_shift': i + 1,
                        }})
 
-    self.conf['run_time'] += run_time
+    self.run_time.extend(run_time)
 
 
 class GenConf_vmgw (GenConf_mgw):
@@ -277,7 +297,9 @@ class GenConf_bng (GenConf):
     super().add_fluct_user()
 
 def list_pipelines ():
-  l = [n[3:] for n in globals() if n.startswith('GenConf_')]
+  prefix = 'GenConf_'
+  l = [n[len(prefix):] for n in globals() if n.startswith(prefix)]
+  l += [Path(f).stem[len(prefix):] for f in find_mod.glob(prefix + '*.py')]
   return sorted(l)
 
 def add_args_from_schema(parser, pipeline_name):
@@ -346,5 +368,8 @@ def parse_cli_args ():
 if __name__ == "__main__":
   args = parse_cli_args()
   conf = gen_conf(args.__dict__)
+  min_size = args.__dict__.get('columnar_min_size', 0)
+  if min_size and not args.output.name.startswith('/dev/'):
+    conf = conf_tables.store_tables(conf, args.output.name, min_size)
   json.dump(conf, args.output, sort_keys=True, indent=4)
   args.output.write("\n")
@@ -15,6 +15,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import random
+from socket import inet_ntoa
+from struct import pack
+
+import numpy as np
+
+try:
+  from gen_lpm import gen_lpm_table, target_offset
+except ImportError:
+  from .gen_lpm import gen_lpm_table, target_offset
+
 def byte_seq (template, seq, offset_first=1):
   try:
     return template % (int(seq / 64516) + offset_first,
@@ -24,12 +36,40 @@ def byte_seq (template, seq, offset_first=1):
     return template % (int(seq / 254), (seq % 254) + 1)
 
 
+class RunTime (object):
+  """Builder of the run-time behaviour (conf['run_time']), the commands
+  executed in every second.  Commands can be added at both ends in
+  constant time, so huge schedules are built in linear time."""
+
+  def __init__ (self):
+    self.commands = collections.deque()
+
+  def __iter__ (self):
+    return iter(self.commands)
+
+  def __len__ (self):
+    return len(self.commands)
+
+  def append (self, command):
+    self.commands.append(command)
+
+  def extend (self, commands):
+    self.commands.extend(commands)
+
+  def wrap (self, add_commands, del_commands):
+    """Add ephemeral entries around the current schedule: `add_commands`
+    are executed first, `del_commands` last (both in the given order)"""
+    self.commands.extendleft(reversed(add_commands))
+    self.commands.extend(del_commands)
+
+
 class GenConf (object):
 
   def __init__ (self, args):
     self.args = args
     self.components = ['base']
     self.conf = {}
+    self.run_time = None
 
   def get_arg (self, arg_name, default=None):
     return self.args.__dict__.get(arg_name.replace('-', '_'), default)
@@ -38,12 +78,14 @@ class GenConf (object):
     for c in self.components:
       method = getattr(self, 'add_%s' % c)
       method()
+    if self.run_time is not None:
+      self.conf['run_time'] = list(self.run_time)
     return self.conf
 
   def add_base (self):
     self.conf['name'] = self.args.name
     self.conf['core'] = self.args.core
-    self.conf['run_time'] = [] # Commands to be executed in every second
+    self.run_time = RunTime() # Commands to be executed in every second
 
   def add_fakedrop (self):
     self.conf['fakedrop'] = self.args.fakedrop
@@ -152,24 +194,17 @@ class GenConf (object):
             'teid': u + self.args.user + 1,
             'rate_limit': self.args.rate_limit,
         })
-    fl_u_add, fl_u_del = [], []
-    for i in range(self.args.fluct_user):
-        user = extra_users[i]
-        fl_u_add = fl_u_add + [{'action': 'add_user', 'args': user}]
-        fl_u_del = [{'action': 'del_user', 'args': user}] + fl_u_del
-
-    self.conf['run_time'] = fl_u_add + self.conf['run_time'] + fl_u_del
+    self.run_time.wrap(
+      [{'action': 'add_user', 'args': user} for user in extra_users],
+      [{'action': 'del_user', 'args': user} for user in reversed(extra_users)])
 
   def add_fluct_server (self):
     # Generate ephemeral servers
     extra_servers = self.create_l3_table(
       self.args.fluct_server, self.args.nhop, '5.%d.%d.2')
-    fl_s_add, fl_s_del = [], []
-    for server in extra_servers:
-        fl_s_add = fl_s_add + [{'action': 'add_server', 'args': server}]
-        fl_s_del = [{'action': 'del_server', 'args': server}] + fl_s_del
-
-    self.conf['run_time'] = fl_s_add + self.conf['run_time'] + fl_s_del
+    self.run_time.wrap(
+      [{'action': 'add_server', 'args': s} for s in extra_servers],
+      [{'action': 'del_server', 'args': s} for s in reversed(extra_servers)])
 
   def create_l3_table (self, size, nhops, addr_template, offset_first=1):
     table = []
@@ -181,6 +216,27 @@ class GenConf (object):
       })
     return table
 
+  def create_lpm_table (self, size, nhops, dist, nesting, octets, extra=0):
+    """Generate an L3 table of `size` routes with prefix lengths
+    distributed as `dist` in the /8 blocks `octets` (see gen_lpm), and
+    `extra` more routes (for run-time updates) from the same
+    distribution.  The 'ip' of an entry is its target address: packets
+    sent to it hit the entry.  Return the two tables."""
+    rng = np.random.RandomState(random.randrange(2 ** 32))
+    prefix, prefix_len = gen_lpm_table(size + extra, dist, nesting,
+                                       octets, rng)
+    target = prefix + target_offset(prefix_len)
+    tables = []
+    for routes in np.split(rng.permutation(size + extra), [size]):
+      routes.sort()
+      targets = target[routes].tolist()
+      lens = prefix_len[routes].tolist()
+      tables.append([{'ip': inet_ntoa(pack('!I', t)),
+                      'prefix_len': l,
+                      'nhop': i % nhops}
+                     for i, (t, l) in enumerate(zip(targets, lens))])
+    return tables
+
   def create_l2_table (self, size, dmac_template, smac_template):
     nhops = []
     for n in range(size):
@@ -0,0 +1,207 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Generate longest prefix match (LPM) tables with realistic prefix
+length distributions.
+
+The routes are placed into a set of /8 blocks.  The disjoint (top
+level) routes are placed like in a buddy allocator: from the shortest
+prefix length to the longest one, each length takes random free
+aligned blocks, and the rest of the free blocks are halved for the
+next length.  A given fraction of the routes is nested into a shorter
+route instead, selected randomly in proportion to its size.
+
+Every route has a target address (the prefix plus target_offset()),
+which is not covered by any longer route, so packets sent to the
+target address hit exactly that route.
+"""
+
+import numpy as np
+
+__all__ = ['PREFIX_LEN_PROFILES', 'parse_prefix_len_dist', 'target_offset',
+           'gen_lpm_table']
+
+# Approximate prefix length histogram of the IPv4 BGP full table
+# (about 950k routes)
+PREFIX_LEN_PROFILES = {
+  'bgp': {8: 15, 9: 13, 10: 37, 11: 101, 12: 283, 13: 559, 14: 1130,
+          15: 1942, 16: 13470, 17: 8020, 18: 13615, 19: 24550,
+          20: 42480, 21: 51950, 22: 117600, 23: 92200, 24: 550000},
+}
+MIN_PREFIX_LEN = 8
+
+def parse_prefix_len_dist (spec):
+  """Parse a prefix length distribution: a profile name ('bgp'), a
+  prefix length, or a weighted list of lengths ('16:1,20:3,24:6').
+  Return {prefix_len: weight}."""
+  spec = str(spec)
+  if spec in PREFIX_LEN_PROFILES:
+    return dict(PREFIX_LEN_PROFILES[spec])
+  dist = {}
+  try:
+    for item in spec.split(','):
+      prefix_len, _, weight = item.partition(':')
+      dist[int(prefix_len)] = float(weight or 1)
+  except ValueError:
+    raise ValueError('invalid prefix length distribution: %s' % spec)
+  for prefix_len in dist:
+    if not MIN_PREFIX_LEN <= prefix_len <= 32:
+      raise ValueError('prefix length must be between %d and 32: %d' %
+                       (MIN_PREFIX_LEN, prefix_len))
+  return dist
+
+def split_counts (dist, size):
+  """Split `size` routes according to `dist` (largest remainder
+  method), return the number of routes indexed by prefix length"""
+  lens = sorted(dist)
+  weights = np.array([dist[l] for l in lens], dtype=np.float64)
+  exact = weights * size / weights.sum()
+  counts = np.floor(exact).astype(np.int64)
+  rest = size - counts.sum()
+  counts[np.argsort(counts - exact, kind='stable')[:rest]] += 1
+  count = np.zeros(33, dtype=np.int64)
+  count[lens] = counts
+  return count
+
+def target_offset (prefix_len):
+  "Offset of the target address within a /prefix_len route"
+  return np.minimum(2, (np.int64(1) << (32 - prefix_len)) - 1)
+
+def place_top (count, octets, rng):
+  "Place count[l] disjoint /l routes into /8 blocks `octets`"
+  free = np.array(sorted(octets), dtype=np.int64) << 24
+  prefixes = []
+  for l in range(MIN_PREFIX_LEN, 33):
+    free = free[rng.permutation(len(free))]
+    prefixes.append(free[:count[l]])
+    rest = free[count[l]:]
+    # Free /l blocks needed by the longer routes.  Keep some more to
+    # spread the routes, but not all of them to save memory.
+    space = (count[l + 1:] << (32 - np.arange(l + 1, 33))).sum()
+    need = -(-space >> (32 - l))
+    if need == 0:
+      break
+    rest = rest[:4 * need]
+    free = np.concatenate([rest, rest + (1 << (31 - l))])
+  lens = [np.full(len(p), l, dtype=np.int64)
+          for l, p in enumerate(prefixes, start=MIN_PREFIX_LEN)]
+  return np.concatenate(prefixes), np.concatenate(lens)
+
+def choose_parents (prefix_len, new_len, num, rng):
+  """Choose the parents of `num` nested /new_len routes among the
+  shorter routes, with a probability proportional to their size"""
+  parents = np.flatnonzero(prefix_len < new_len)
+  weights = np.ldexp(1.0, new_len - prefix_len[parents]) - 1
+  return rng.choice(parents, size=num, p=weights / weights.sum())
+
+def place_nested (parent_prefix, parent_len, prefix_len, rng):
+  """Place /prefix_len routes into the parents avoiding the block of
+  the parents' target addresses"""
+  shift = 32 - prefix_len
+  blocks = np.int64(1) << (prefix_len - parent_len)
+  skip = target_offset(parent_len) >> shift
+  block = np.floor(rng.random_sample(len(parent_prefix)) *
+                   (blocks - 1)).astype(np.int64)
+  block += block >= skip
+  return parent_prefix + (block << shift)
+
+def find_conflicts (prefix, prefix_len):
+  """Return the indices of the routes that duplicate another route or
+  cover the target address of a shorter route.  The routes must be
+  ordered by prefix length."""
+  bad = []
+  # Sorted needles make searchsorted much faster
+  target = prefix + target_offset(prefix_len)
+  target_order = np.argsort(target)
+  target, target_len = target[target_order], prefix_len[target_order]
+  bounds = np.searchsorted(prefix_len, np.arange(34))
+  for l in range(MIN_PREFIX_LEN, 33):
+    first, last = bounds[l], bounds[l + 1]
+    if first == last:
+      continue
+    keys = prefix[first:last] >> (32 - l)
+    key_order = np.argsort(keys)
+    keys = keys[key_order]
+    bad.append(first + key_order[1:][keys[1:] == keys[:-1]])
+    t = target[target_len < l] >> (32 - l)
+    pos = np.minimum(np.searchsorted(keys, t), len(keys) - 1)
+    bad.append(first + key_order[pos[keys[pos] == t]])
+  return np.unique(np.concatenate(bad))
+
+def gen_lpm_table (size, dist, nesting, octets, rng, max_iter=100):
+  """Generate `size` routes in the /8 blocks `octets` (first octets)
+  with prefix lengths distributed as `dist` ({prefix_len: weight}).
+  `nesting` fraction of the routes of each prefix length (but the
+  shortest one) is placed into a shorter route, if the shorter routes
+  have enough room for them, the rest of the routes are disjoint.  `rng` is a numpy RandomState.
+
+  Return the prefixes and the prefix lengths (sorted arrays)."""
+  count = split_counts(dist, size)
+  nested = np.rint(count * nesting).astype(np.int64)
+  nested[:np.flatnonzero(count)[0] + 1] = 0
+  top = count - nested
+  for l in range(MIN_PREFIX_LEN + 1, 33):
+    # Nest at most into the half of the free /l blocks of the shorter
+    # routes, place the rest of the routes at the top level
+    blocks = (top[:l] << (l - np.arange(l))).sum() - count[:l].sum()
+    excess = max(0, nested[l] - blocks // 2)
+    nested[l] -= excess
+    top[l] += excess
+  capacity = len(octets) << 24
+  space = (top << (32 - np.arange(33))).sum()
+  if space > capacity:
+    raise ValueError('%d routes do not fit into %d /8 blocks, '
+                     'increase the nesting' % (size, len(octets)))
+
+  prefix, prefix_len = place_top(top, octets, rng)
+  is_nested = np.zeros(len(prefix), dtype=bool)
+  for l in range(MIN_PREFIX_LEN + 1, 33):
+    if not nested[l]:
+      continue
+    parents = choose_parents(prefix_len, l, nested[l], rng)
+    new = place_nested(prefix[parents], prefix_len[parents], l, rng)
+    prefix = np.concatenate([prefix, new])
+    prefix_len = np.concatenate([prefix_len,
+                                 np.full(nested[l], l, dtype=np.int64)])
+    is_nested = np.concatenate([is_nested, np.ones(nested[l], dtype=bool)])
+
+  order = np.argsort(prefix_len, kind='stable')
+  prefix, prefix_len, is_nested = (prefix[order], prefix_len[order],
+                                   is_nested[order])
+
+  # Move the nested routes that collide with other routes.  Only
+  # nested routes can collide, and only with nested routes or with
+  # the target address of their ancestors.  A collision is always
+  # within a /8 block, so only the blocks of the moved routes are
+  # checked again.
+  check = np.arange(len(prefix))
+  for _ in range(max_iter):
+    bad = check[find_conflicts(prefix[check], prefix_len[check])]
+    bad = bad[is_nested[bad]]
+    if len(bad) == 0:
+      break
+    for l in np.unique(prefix_len[bad]):
+      routes = bad[prefix_len[bad] == l]
+      parents = choose_parents(prefix_len, l, len(routes), rng)
+      prefix[routes] = place_nested(prefix[parents], prefix_len[parents],
+                                    l, rng)
+    check = np.flatnonzero(np.isin(prefix >> 24, prefix[bad] >> 24))
+  else:
+    raise ValueError('cannot place the nested routes, decrease the nesting')
+
+  order = np.lexsort((prefix_len, prefix))
+  return prefix[order], prefix_len[order]
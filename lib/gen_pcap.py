@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # TIPSY: Telco pIPeline benchmarking SYstem
 #
@@ -17,32 +17,33 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-# scapy in python3 does not support VXLAN headers,
-# so we stick with python2
-
 import argparse
+import binascii
+import collections
 import json
 import math
 import multiprocessing
+import os
 import random
-import scapy
+import subprocess
 import sys
-try:
-    from pathlib import PosixPath
-except ImportError:
-    # python2
-    PosixPath = str
-from scapy.all import *
-from scapy.contrib.gtp import *
+import time
+from pathlib import PosixPath
 
 try:
     import args_from_schema
+    import conf_tables
     import find_mod
+    from gen_lpm import parse_prefix_len_dist
     from gen_pcap_base import *
+    from pkt_hdr import *
 except ImportError:
     from . import args_from_schema
+    from . import conf_tables
     from . import find_mod
+    from .gen_lpm import parse_prefix_len_dist
     from .gen_pcap_base import *
+    from .pkt_hdr import *
 
 __all__ = ["gen_pcap"]
 
@@ -62,26 +63,35 @@ class ObjectView(object):
 
 
 class GenPkt_portfwd(GenPkt):
+    use_template = True
 
     def get_auto_pkt_num(self):
         return 1024
 
-    def gen_pkt(self, pkt_idx):
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+    def gen_template(self, key):
+        fields = {'smac': 'Ether.src', 'dmac': 'Ether.dst', 'dip': 'IP.dst'}
+        return Ether() / IP(), fields
+
+    def gen_fields_batch(self, pkt_idxs):
+        n = len(pkt_idxs)
+        rng = self.rng
+        smac = byte_seq_int(0xaabbbbaa0000, rng.randint(1, 65023, size=n))
+        dmac = byte_seq_int(0xaaccddcc0000, rng.randint(1, 65023, size=n))
+        dip = byte_seq_int(0x03030000, rng.randint(1, 255, size=n))
+        return [(None, slice(None), n,
+                 {'smac': smac, 'dmac': dmac, 'dip': dip})]
 
 
 class GenPkt_l2fwd(GenPkt):
+    use_template = True
+
     def __init__(self, *args, **kw):
         super(GenPkt_l2fwd, self).__init__(*args, **kw)
         if self.args.dir.startswith('u'):
             self.table = self.conf.upstream_table
         else:
             self.table = self.conf.downstream_table
+        self.table_mac = table2array(self.table, 'mac', mac2int)
 
     def get_auto_pkt_num(self):
         dir = self.args.dir
@@ -95,25 +105,55 @@ class GenPkt_l2fwd(GenPkt):
         else:
             raise ValueError
 
-    def gen_pkt(self, pkt_idx):
-        dmac = self.table[pkt_idx % len(self.table)].mac
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+    def gen_template(self, key):
+        fields = {'smac': 'Ether.src', 'dmac': 'Ether.dst', 'dip': 'IP.dst'}
+        return Ether() / IP(), fields
+
+    def gen_fields_batch(self, pkt_idxs):
+        n = len(pkt_idxs)
+        rng = self.rng
+        dmac = self.table_mac[np.asarray(pkt_idxs) % len(self.table)]
+        smac = byte_seq_int(0xaabbbbaa0000, rng.randint(1, 65023, size=n))
+        dip = byte_seq_int(0x03030000, rng.randint(1, 255, size=n))
+        return [(None, slice(None), n,
+                 {'smac': smac, 'dmac': dmac, 'dip': dip})]
 
 
 class GenPkt_l3fwd(GenPkt):
+    use_template = True
+
     def __init__(self, *args, **kw):
         super(GenPkt_l3fwd, self).__init__(*args, **kw)
         if self.args.dir.startswith('u'):
             self.l3_table = self.conf.upstream_l3_table
         else:
             self.l3_table = self.conf.downstream_l3_table
+        self.l3_table_ip = table2array(self.l3_table, 'ip', ip2int)
+        if self.args.prefix_len_weights:
+            routes = self.weighted_routes(self.args.prefix_len_weights)
+            self.l3_table_ip = self.l3_table_ip[routes]
         self.sut_mac = getattr(self.conf.sut,
                                '%sl_port_mac' % self.get_other_direction())
 
+    def weighted_routes(self, spec):
+        """Return a sequence of route indices that hits the prefix lengths
+        according to the weights of `spec` ('16:1,24:3').  The lengths
+        are evenly interleaved, the routes of a length are cycled."""
+        weights = parse_prefix_len_dist(spec)
+        prefix_len = table2array(self.l3_table, 'prefix_len')
+        n = len(self.l3_table)
+        total = sum(weights.values())
+        seqs, pos = [], []
+        for length, weight in sorted(weights.items()):
+            routes = np.flatnonzero(prefix_len == length)
+            if len(routes) == 0:
+                raise ValueError('no /%d route in the l3 table' % length)
+            count = int(round(n * weight / total))
+            seqs.append(routes[np.arange(count) % len(routes)])
+            pos.append((np.arange(count) + 0.5) / count)
+        order = np.argsort(np.concatenate(pos), kind='stable')
+        return np.concatenate(seqs)[order]
+
     def get_auto_pkt_num(self):
         dir = self.args.dir
         if 'd' in dir:  # downstream
@@ -126,127 +166,239 @@ class GenPkt_l3fwd(GenPkt):
         else:
             raise ValueError
 
-    def gen_pkt(self, pkt_idx):
+    def gen_template(self, key):
         # NB.  In the uplink case, the traffic leaves Tester via its
         # uplink port and arrives at the downlink of the SUT.
-        ip = self.l3_table[pkt_idx % len(self.l3_table)].ip
-        p = Ether(dst=self.sut_mac) / IP(dst=ip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        return Ether(dst=self.sut_mac) / IP(), {'dip': 'IP.dst'}
+
+    def gen_fields_batch(self, pkt_idxs):
+        ip = self.l3_table_ip[np.asarray(pkt_idxs) % len(self.l3_table_ip)]
+        return [(None, slice(None), len(pkt_idxs), {'dip': ip})]
 
 
 class GenPkt_mgw(GenPkt):
+    use_template = True
+
+    def __init__(self, *args, **kw):
+        super(GenPkt_mgw, self).__init__(*args, **kw)
+        conf = self.conf
+        self.srvs_ip = table2array(conf.srvs, 'ip', ip2int)
+        self.users_ip = table2array(conf.users, 'ip', ip2int)
+        self.users_teid = table2array(conf.users, 'teid')
+        self.users_tun_end = table2array(conf.users, 'tun_end')
+        self.bsts_mac = table2array(conf.bsts, 'mac', mac2int)
+        self.bsts_ip = table2array(conf.bsts, 'ip', ip2int)
 
     def get_auto_pkt_num(self):
         return len(self.conf.users)
 
-    def gen_pkt(self, pkt_idx):
+    def gen_fields_batch(self, pkt_idxs):
         direction = '%s' % self.args.dir[0]
-        pkt_size = self.args.pkt_size
+        n = len(pkt_idxs)
+        rng = self.rng
+        server = rng.randint(len(self.srvs_ip), size=n)
+        user = rng.randint(len(self.users_ip), size=n)
+        proto = rng.randint(2, size=n)
+        groups = []
+        for proto_idx, proto_cl in enumerate([TCP, UDP]):
+            sel = np.flatnonzero(proto == proto_idx)
+            if len(sel) == 0:
+                continue
+            srv_ip = self.srvs_ip[server[sel]]
+            u = user[sel]
+            if 'd' == direction:
+                values = {'srv_ip': srv_ip, 'user_ip': self.users_ip[u]}
+            elif 'u' == direction:
+                bst = self.users_tun_end[u]
+                values = {'bst_mac': self.bsts_mac[bst],
+                          'bst_ip': self.bsts_ip[bst],
+                          'teid': self.users_teid[u],
+                          'user_ip': self.users_ip[u], 'srv_ip': srv_ip}
+            groups.append(((direction, proto_cl), sel, len(sel), values))
+        return groups
+
+    def template_keys(self):
+        return [(self.args.dir[0], proto) for proto in (TCP, UDP)]
+
+    def gen_template(self, key):
+        direction, proto = key
         gw = self.conf.gw
-        server = random.choice(self.conf.srvs)
-        user = random.choice(self.conf.users)
-        proto = random.choice([TCP, UDP])
         if 'd' == direction:
-            return self.gen_dl_pkt(pkt_size, proto, gw, server, user)
+            return self.gen_dl_template(proto, gw)
         elif 'u' == direction:
-            bst = self.conf.bsts[user.tun_end]
-            return self.gen_ul_pkt(pkt_size, proto, gw, server, user, bst)
+            return self.gen_ul_template(proto, gw)
 
-    def gen_dl_pkt(self, pkt_size, proto, gw, server, user):
+    def gen_dl_template(self, proto, gw):
         p = (
             Ether(dst=gw.mac) /
-            IP(src=server.ip, dst=user.ip) /
+            IP() /
             proto()
         )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        return p, {'srv_ip': 'IP.src', 'user_ip': 'IP.dst'}
 
-    def gen_ul_pkt(self, *args):
-        attr = getattr(self, 'gen_ul_pkt_%s' % self.args.tunneling_method)
+    def gen_ul_template(self, *args):
+        attr = getattr(self, 'gen_ul_template_%s' % self.args.tunneling_method)
         return attr(*args)
 
-    def gen_ul_pkt_vxlan(self, pkt_size, proto, gw, server, user, bst):
+    def gen_ul_template_vxlan(self, proto, gw):
         p = (
-            Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
-            IP(src=bst.ip, dst=gw.ip) /
+            Ether(dst=gw.mac, type=0x0800) /
+            IP(dst=gw.ip) /
             UDP(sport=4789, dport=4789) /
-            VXLAN(vni=user.teid, flags=0x08) /
+            VXLAN(flags=0x08) /
             Ether(dst=gw.mac, type=0x0800) /
-            IP(src=user.ip, dst=server.ip) /
+            IP() /
             proto()
         )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        return p, {'bst_mac': 'Ether.src', 'bst_ip': 'IP.src',
+                   'teid': 'VXLAN.vni',
+                   'user_ip': 'IP:2.src', 'srv_ip': 'IP:2.dst'}
 
-    def gen_ul_pkt_gtp(self, pkt_size, proto, gw, server, user, bst):
+    def gen_ul_template_gtp(self, proto, gw):
         p = (
-            Ether(src=bst.mac, dst=gw.mac, type=0x0800) /
-            IP(src=bst.ip, dst=gw.ip) /
+            Ether(dst=gw.mac, type=0x0800) /
+            IP(dst=gw.ip) /
             UDP(sport=2152, dport=2152) /
-            GTPHeader(teid=user.teid, version=1) /
-            IP(src=user.ip, dst=server.ip) /
+            GTPHeader() /
+            IP() /
             proto()
         )
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        return p, {'bst_mac': 'Ether.src', 'bst_ip': 'IP.src',
+                   'teid': 'GTPHeader.teid',
+                   'user_ip': 'IP:2.src', 'srv_ip': 'IP:2.dst'}
 
 
 class GenPkt_vmgw(GenPkt_mgw):
-    def gen_pkt(self, pkt_idx):
-        pkt = super(GenPkt_vmgw, self).gen_pkt(pkt_idx)
+    def encap(self, pkt, fields):
         # Add VXLAN header for infra processing
-        vxlan_pkt = (
+        outer = (
             Ether(src=self.conf.dcgw.mac, dst=self.conf.gw.mac) /
             IP(src=self.conf.dcgw.ip, dst=self.conf.gw.ip) /
             UDP(sport=4788, dport=4789) /
-            VXLAN(vni=self.conf.dcgw.vni) /
-            pkt
+            VXLAN(vni=self.conf.dcgw.vni)
         )
-        return vxlan_pkt
+        return outer / pkt, encap_fields(fields, outer)
 
 
 class GenPkt_bng(GenPkt):
+    use_template = True
+
+    def __init__(self, *args, **kw):
+        super(GenPkt_bng, self).__init__(*args, **kw)
+        conf = self.conf
+        # Index the NAT entries by user, so that picking a connection
+        # of a user does not scan the whole NAT table.
+        user_idx = {u.ip: i for i, u in enumerate(conf.users)}
+        self.user_nat = [[] for _ in conf.users]
+        for e in conf.nat_table:
+            if e.priv_ip in user_idx:
+                self.user_nat[user_idx[e.priv_ip]].append(e)
+        nat = [e for entries in self.user_nat for e in entries]
+        counts = [len(l) for l in self.user_nat]
+        self.user_nat_count = np.array(counts, dtype=np.uint64)
+        self.user_nat_start = np.cumsum([0] + counts[:-1], dtype=np.uint64)
+        self.nat_proto = table2array(nat, 'proto')
+        self.nat_pub_ip = table2array(nat, 'pub_ip', ip2int)
+        self.nat_pub_port = table2array(nat, 'pub_port')
+        self.nat_priv_port = table2array(nat, 'priv_port')
+        self.srvs_ip = table2array(conf.srvs, 'ip', ip2int)
+        self.users_ip = table2array(conf.users, 'ip', ip2int)
+        self.users_teid = table2array(conf.users, 'teid')
+        self.users_tun_end = table2array(conf.users, 'tun_end')
+        self.cpe_mac = table2array(conf.cpe, 'mac', mac2int)
+        self.cpe_ip = table2array(conf.cpe, 'ip', ip2int)
 
     def get_auto_pkt_num(self):
         return len(self.conf.nat_table)
 
-    def gen_pkt(self, pkt_idx):
-        protos = {'6': TCP, '17': UDP}
-        gw = self.conf.gw
-        server = random.choice(self.conf.srvs)
-        user = random.choice(self.conf.users)
-        user_nat = random.choice([e for e in self.conf.nat_table
-                                  if e.priv_ip == user.ip])
-        proto = protos[str(user_nat.proto)]
+    def gen_fields_batch(self, pkt_idxs):
+        n = len(pkt_idxs)
+        rng = self.rng
+        server = rng.randint(len(self.srvs_ip), size=n)
+        user = rng.randint(len(self.users_ip), size=n)
+        count = self.user_nat_count[user]
+        if not count.all():
+            raise ValueError('user without NAT entries')
+        offset = (rng.random_sample(n) * count).astype(np.uint64)
+        nat = self.user_nat_start[user] + offset
+        proto = self.nat_proto[nat]
         if 'd' in self.args.dir:
+            direction = 'd'
+        elif 'u' in self.args.dir:
+            direction = 'u'
+        else:
+            raise ValueError
+        groups = []
+        for proto_num, proto_cl in [(6, TCP), (17, UDP)]:
+            sel = np.flatnonzero(proto == proto_num)
+            if len(sel) == 0:
+                continue
+            srv_ip = self.srvs_ip[server[sel]]
+            u = user[sel]
+            e = nat[sel]
+            if 'd' == direction:
+                values = {'srv_ip': srv_ip,
+                          'pub_ip': self.nat_pub_ip[e],
+                          'sport': self.nat_pub_port[e],
+                          'dport': self.nat_pub_port[e]}
+            else:
+                cpe = self.users_tun_end[u]
+                values = {'cpe_mac': self.cpe_mac[cpe],
+                          'cpe_ip': self.cpe_ip[cpe],
+                          'teid': self.users_teid[u],
+                          'user_ip': self.users_ip[u], 'srv_ip': srv_ip,
+                          'sport': self.nat_priv_port[e],
+                          'dport': self.nat_priv_port[e]}
+            groups.append(((direction, proto_cl), sel, len(sel), values))
+        if sum(g[2] for g in groups) != n:
+            raise ValueError('unknown protocol in the NAT table')
+        return groups
+
+    def template_keys(self):
+        return [(self.args.dir[0], proto) for proto in (TCP, UDP)]
+
+    def gen_template(self, key):
+        direction, proto = key
+        gw = self.conf.gw
+        l4 = proto.__name__
+        if 'd' == direction:
             pkt = (
                 Ether(dst=gw.mac) /
-                IP(src=server.ip, dst=user_nat.pub_ip) /
-                proto(sport=user_nat.pub_port, dport=user_nat.pub_port)
+                IP() /
+                proto()
             )
-        elif 'u' in self.args.dir:
-            cpe = self.conf.cpe[user.tun_end]
+            fields = {'srv_ip': 'IP.src', 'pub_ip': 'IP.dst',
+                      'sport': '%s.sport' % l4, 'dport': '%s.dport' % l4}
+        else:
             pkt = (
-                Ether(src=cpe.mac, dst=gw.mac, type=0x0800) /
-                IP(src=cpe.ip, dst=gw.ip) /
+                Ether(dst=gw.mac, type=0x0800) /
+                IP(dst=gw.ip) /
                 UDP(sport=4789, dport=4789) /
-                VXLAN(vni=user.teid, flags=0x08) /
+                VXLAN(flags=0x08) /
                 Ether(dst=gw.mac, type=0x0800) /
-                IP(src=user.ip, dst=server.ip) /
-                proto(sport=user_nat.priv_port, dport=user_nat.priv_port)
+                IP() /
+                proto()
             )
-        else:
-            raise ValueError
-        pkt = self.add_payload(pkt, self.args.pkt_size)
-        return pkt
+            # NB. The outer UDP header is the first UDP layer
+            l4 = {'TCP': 'TCP', 'UDP': 'UDP:2'}[l4]
+            fields = {'cpe_mac': 'Ether.src', 'cpe_ip': 'IP.src',
+                      'teid': 'VXLAN.vni',
+                      'user_ip': 'IP:2.src', 'srv_ip': 'IP:2.dst',
+                      'sport': '%s.sport' % l4, 'dport': '%s.dport' % l4}
+        return pkt, fields
 
 
 class GenPkt_fw(GenPkt):
+    use_template = True
+
     def __init__(self, *args, **kw):
         super(GenPkt_fw, self).__init__(*args, **kw)
         self.args.auto_pkt_num = True
 
+    def prepare(self):
+        # Flows are sampled from the trace in create_work_items()
+        self.check_pkt_size()
+
     def create_work_items(self, job_size):
         # Call `trace_generator` first
         args = self.args
@@ -260,49 +412,131 @@ class GenPkt_fw(GenPkt):
 
         print(' '.join(cmd))
         subprocess.check_call(cmd)
-        with open(tracefile) as f:
-            lines = f.readlines()
-        self.args.pkt_num = len(lines)
-
-        items = []
-        for job_idx, ls in enumerate(grouper(job_size, lines)):
-            ls = [l for l in ls if l is not None]
-            items.append({'job_idx': job_idx, 'pkt_idxs': ls})
-        return items
-
-    def gen_pkt(self, line):
-        def int2ip(ip):
-            return socket.inet_ntoa(hex(ip)[2:].zfill(8).decode('hex'))
-        vals = line.split('\t')
-        src, dst, sport, dport, proto, a, b = [int(v) for v in vals]
-        src = int2ip(src)
-        dst = int2ip(dst)
-
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dst, src=src, proto=proto)
-        if proto == 6:   # TCP
-            p = p / TCP(sport=sport, dport=dport)
-        if proto == 17:  # UDP
-            p = p / UDP(sport=sport, dport=dport)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
-
-def output_pkts(args, pkts):
+        self.args.pkt_num = count_lines(tracefile)
+        if self.flow_dist.is_uniform():
+            chunks = self.read_trace(tracefile)
+        else:
+            chunks = self.sample_trace(tracefile, job_size)
+        job_idx = 0
+        for chunk in chunks:
+            for start in range(0, len(chunk), job_size):
+                yield {'job_idx': job_idx,
+                       'pkt_idxs': chunk[start:start + job_size]}
+                job_idx += 1
+
+    def read_trace(self, tracefile):
+        "Yield the (src, dst, sport, dport, proto) columns of the trace"
+        for chunk in read_int_table(tracefile):
+            yield chunk[:, :5]
+
+    def sample_trace(self, tracefile, job_size):
+        """Yield flows sampled from the distinct headers of the trace
+        (in the order of their first appearance)"""
+        flows = [np.unique(c, axis=0) for c in self.read_trace(tracefile)]
+        if not flows:
+            return
+        flows, first = np.unique(np.concatenate(flows), axis=0,
+                                 return_index=True)
+        flows = flows[np.argsort(first)]
+        for start in range(0, self.args.pkt_num, job_size):
+            n = min(job_size, self.args.pkt_num - start)
+            yield flows[self.flow_dist.sample(len(flows), n, self.rng)]
+
+    def template_keys(self):
+        # The trace might contain any protocol, 0 stands for the others
+        return [6, 17, 0]
+
+    def gen_template(self, proto):
+        p = Ether() / IP(proto=proto)
+        fields = {'smac': 'Ether.src', 'dmac': 'Ether.dst',
+                  'src': 'IP.src', 'dst': 'IP.dst'}
+        l4 = {6: TCP, 17: UDP}.get(proto)
+        if l4:
+            p = p / l4()
+            fields['sport'] = '%s.sport' % l4.__name__
+            fields['dport'] = '%s.dport' % l4.__name__
+        return p, fields
+
+    def gen_fields_batch(self, pkt_idxs):
+        n = len(pkt_idxs)
+        rng = self.rng
+        src, dst, sport, dport, proto = pkt_idxs.T
+        smac = byte_seq_int(0xaabbbbaa0000, rng.randint(1, 65023, size=n))
+        dmac = byte_seq_int(0xaaccddcc0000, rng.randint(1, 65023, size=n))
+        groups = []
+        for p in np.unique(proto):
+            sel = np.flatnonzero(proto == p)
+            values = {'smac': smac[sel], 'dmac': dmac[sel],
+                      'src': src[sel], 'dst': dst[sel]}
+            if p in (6, 17):   # TCP, UDP
+                values.update({'sport': sport[sel], 'dport': dport[sel]})
+            groups.append((int(p), sel, len(sel), values))
+        return groups
+
+def output_pkts(args, ring, slot, count, dirs=None):
     if args.ascii:
-        for p in pkts:
+        # scapy is only needed to dissect the packets
+        try:
+            import scapy.all
+            import scapy.contrib.gtp
+        except ImportError:
+            scapy = None
+        for p in ring.pkts(slot, count):
+            if scapy is None:
+                print(binascii.hexlify(p).decode())
+                continue
             if sys.stdout.isatty():
-                #scapy.config.conf.color_theme = themes.DefaultTheme()
-                scapy.config.conf.color_theme = scapy.themes.ColorOnBlackTheme()
-            print(p.__repr__())
+                scapy.all.conf.color_theme = scapy.all.ColorOnBlackTheme()
+            print(scapy.all.Ether(p).__repr__())
     else:
+        sizes, counts = np.unique(ring.lens[slot, :count], return_counts=True)
+        repeat = 1
         if args.auto_pkt_num and args.pkt_num < 1024:
-            pkts = list(pkts)
-            if pkts == []:
+            if count == 0:
                 exit(-1)
-            while len(pkts) < 1024:
-                pkts = pkts + pkts
-        args.pcap_file.write(pkts)
+            while count * repeat < 1024:
+                repeat += repeat
+        for size, cnt in zip(sizes, counts):
+            args.size_hist[int(size)] += int(cnt) * repeat
+        if dirs is None or args.bidir_output == 'tagged':
+            records = args.pcap_file.records(ring, slot, range(count))
+            args.pcap_file.write(records * repeat)
+        if dirs is None:
+            return
+        if args.bidir_output == 'tagged':
+            tags = b''.join(b'u' if d else b'd' for d in dirs[:count])
+            args.dir_file.write(tags * repeat)
+        else:
+            up = np.flatnonzero(dirs[:count])
+            down = np.flatnonzero(~dirs[:count])
+            args.pcap_file.write(
+                args.pcap_file.records(ring, slot, up) * repeat)
+            args.pcap_file_dl.write(
+                args.pcap_file_dl.records(ring, slot, down) * repeat)
+
+def write_stats(args):
+    "Write the statistics of the generated traffic next to the pcap"
+    # Skip /dev/stdout, /dev/null, etc., but not named pipes
+    if args.output.name.startswith('/dev/'):
+        return
+    stats = {
+        'pkt-num': sum(args.size_hist.values()),
+        'pkt-size-histogram': {str(size): cnt for size, cnt
+                               in sorted(args.size_hist.items())},
+    }
+    with open(args.output.name + '.stats.json', 'w') as f:
+        json.dump(stats, f, indent=4, sort_keys=True, separators=(',', ': '))
+
+def abort(processes, result):
+    """Stop the workers after the failure of one of them, and exit with
+    an error, so that the incomplete pcap is not used (or cached)"""
+    print('Exception: %s' % result['exception'], file=sys.stderr)
+    print(''.join(result['traceback']), file=sys.stderr)
+    for p in processes:
+        p.terminate()
+    for p in processes:
+        p.join()
+    sys.exit(1)
 
 def gen_pcap(*defaults):
     args = parse_args(defaults)
@@ -314,63 +548,134 @@ def gen_pcap(*defaults):
     in_que = multiprocessing.Queue()
     out_que = multiprocessing.Queue()
     gen_pkt_class = find_mod.find_class('GenPkt', conf.name)
-    gen_pkt_obj = gen_pkt_class(args, conf, in_que, out_que)
+    if args.dir == 'bidir':
+        gen_pkt_obj = BidirGenPkt(gen_pkt_class, args, conf, in_que, out_que)
+    else:
+        gen_pkt_obj = gen_pkt_class(args, conf, in_que, out_que)
+    gen_pkt_obj.prepare()
     worker_num = max(1, args.thread)
     job_size = 1024
+    ring = PktRing(2 * worker_num + 2, job_size, gen_pkt_obj.get_max_pkt_len())
+    gen_pkt_obj.ring = ring
 
     if args.ascii:
         print("Dumping packets:")
     else:
-        args.pcap_file = PcapWriter(args.output.name)
+        args.pcap_file = PcapFile(args.output.name, args.compression)
+        args.size_hist = collections.Counter()
+        if args.dir == 'bidir' and args.bidir_output == 'tagged':
+            args.dir_file = open(args.output.name + '.dir', 'wb')
+        elif args.dir == 'bidir':
+            args.pcap_file_dl = PcapFile(downlink_fname(args.output.name),
+                                         args.compression)
+
+    prof = Profile(args.profile != 'none')
+    if args.profile == 'cprofile':
+        import cProfile
+        cprof = cProfile.Profile()
+        cprof.enable()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
 
     processes = []
     for i in range(worker_num):
-        p = multiprocessing.Process(target=gen_pkt_obj.do_work)
+        p = multiprocessing.Process(target=gen_pkt_obj.do_work, args=(i,))
         p.start()
         processes.append(p)
 
+    # Jobs are submitted lazily: at most `window` jobs can be queued,
+    # processed or waiting in the reorder buffer (`results`) for the
+    # completion of a preceding job.
+    items = gen_pkt_obj.create_work_items(job_size)
+    window = ring.slot_num
     num_jobs = 0
-    for item in gen_pkt_obj.create_work_items(job_size):
-        in_que.put(item)
-        num_jobs += 1
-
-    results = []
+    pkt_offset = 0
+    all_submitted = False
+    results = {}
     next_idx = 0
-    while next_idx < num_jobs:
-        result = out_que.get()
+    while True:
+        while not all_submitted and num_jobs - next_idx < window:
+            try:
+                with prof.stage('create-jobs'):
+                    item = next(items)
+                item['pkt_offset'] = pkt_offset
+                pkt_offset += len(item['pkt_idxs'])
+                with prof.stage('submit'):
+                    in_que.put(item)
+                num_jobs += 1
+            except StopIteration:
+                all_submitted = True
+        if all_submitted and next_idx == num_jobs:
+            break
+        prof.sample('in-queue', in_que.qsize)
+        prof.sample('free-slots', ring.free.qsize)
+        with prof.stage('result-wait'):
+            result = out_que.get()
         if 'exception' in result:
-            print('Exception: %s' % result['exception'])
-            print(''.join(result['traceback']))
-            exit()
+            abort(processes, result)
         # print('idx: %s' % result['job_idx'])
-        results.append(result)
-        results.sort(key=lambda x: x['job_idx'])
-        # print([x['job_idx'] for x in results])
-        while len(results) > 0 and results[0]['job_idx'] == next_idx:
-            # print('w: %s' % results[0]['job_idx'])
-            pkts = [PicklablePacket.__call__(p) for p in results[0]['pkts']]
-            output_pkts(args, pkts)
-            results.pop(0)
+        results[result['job_idx']] = result
+        prof.sample('reorder-buffer', len(results))
+        while next_idx in results:
+            # print('w: %s' % next_idx)
+            result = results.pop(next_idx)
+            with prof.stage('output'):
+                output_pkts(args, ring, result['slot'], result['count'],
+                            result.get('dirs'))
+            ring.put_slot(result['slot'])
             next_idx += 1
 
     # stop workers
     for i in range(worker_num):
         in_que.put(None)
+    workers = []
+    if prof.enabled:
+        # The workers send their profile before exiting
+        while len(workers) < worker_num:
+            result = out_que.get()
+            if 'exception' in result:
+                abort(processes, result)
+            workers.append(result)
     for p in processes:
         p.join()
 
-    if not args.ascii:
-        args.pcap_file.close()
+    with prof.stage('close'):
+        if not args.ascii:
+            args.pcap_file.close()
+            if args.dir == 'bidir' and args.bidir_output == 'tagged':
+                args.dir_file.close()
+            elif args.dir == 'bidir':
+                args.pcap_file_dl.close()
+            write_stats(args)
+
+    if prof.enabled:
+        if args.profile == 'cprofile':
+            cprof.disable()
+            cprof.dump_stats('%s.parent.prof' % profile_fname(args))
+        summary = {
+            'wall-time': round(time.perf_counter() - start_wall, 6),
+            'parent-cpu-time': round(time.process_time() - start_cpu, 6),
+            'pkt-num': pkt_offset,
+            'job-num': num_jobs,
+            'job-size': job_size,
+            'thread': worker_num,
+            'ring-slots': ring.slot_num,
+            'parent': prof.as_dict(),
+            'workers': sorted(workers, key=lambda w: w['worker']),
+        }
+        fname = '%s.profile.json' % profile_fname(args)
+        with open(fname, 'w') as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+        print('Profile written to %s' % fname, file=sys.stderr)
 
 def json_load(file, object_hook=None):
     if type(file) == str:
         with open(file, 'r') as infile:
-            return json.load(infile, object_hook=object_hook)
+            return conf_tables.load(infile, object_hook=object_hook)
     elif type(file) == PosixPath:
         with file.open('r') as infile:
-            return json.load(infile, object_hook=object_hook)
+            return conf_tables.load(infile, object_hook=object_hook)
     else:
-        return json.load(file, object_hook=object_hook)
+        return conf_tables.load(file, object_hook=object_hook)
 
 def parse_args(defaults=None):
     if defaults:
@@ -15,11 +15,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-from itertools import izip, chain, repeat
+from itertools import chain, repeat
+from math import gcd
+import contextlib
+import copy
+import hashlib
+import multiprocessing
 import random
+import struct
+import time
 import traceback
 
-from scapy.all import *
+import numpy as np
+
+try:
+    import conf_tables
+    import pcap_compress
+    from conf_tables import ip2int, mac2int
+    from pkt_hdr import *
+except ImportError:
+    from . import conf_tables
+    from . import pcap_compress
+    from .conf_tables import ip2int, mac2int
+    from .pkt_hdr import *
 
 def byte_seq(template, seq):
     return template % (int(seq / 254), (seq % 254) + 1)
@@ -27,62 +45,826 @@ def byte_seq(template, seq):
 # https://stackoverflow.com/a/312644
 def grouper(n, iterable, padvalue=None):
     "grouper(3, 'abcdefg', 'x') --> ('a','b','c'), ('d','e','f'), ('g','x','x')"
-    return izip(*[chain(iterable, repeat(padvalue, n-1))]*n)
+    return zip(*[chain(iterable, repeat(padvalue, n-1))]*n)
+
+def shuffled_range(n, chunk_size):
+    """Yield a pseudo-random permutation of range(n) in chunks (numpy
+    arrays) without materializing it: i -> (a * i + c) % n, where a is
+    a random number coprime to n."""
+    if n == 0:
+        return
+    a = random.randrange(1, n) if n > 1 else 1
+    while gcd(a, n) != 1:
+        a = random.randrange(1, n)
+    c = random.randrange(n)
+    for start in range(0, n, chunk_size):
+        i = np.arange(start, min(start + chunk_size, n), dtype=np.int64)
+        yield (a * i + c) % n
+
+def job_seed(seed, job_idx):
+    """Return the seed of the random streams of job `job_idx` derived
+    from the global `seed`.  Jobs get independent streams no matter
+    which worker processes them."""
+    digest = hashlib.sha256(('%d/%d' % (seed, job_idx)).encode()).digest()
+    return np.frombuffer(digest, dtype=np.uint32)
+
+def read_int_table(fname, chunk_size=1 << 22):
+    """Yield the rows of a text file of whitespace separated integers
+    (e.g., a classbench trace) as 2D int64 arrays.  The file is read
+    and parsed in chunks of about `chunk_size` bytes."""
+    cols = None
+    rest = b''
+    with open(fname, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            buf = rest + data
+            end = buf.rfind(b'\n') + 1 if data else len(buf)
+            lines, rest = buf[:end], buf[end:]
+            if lines.strip():
+                if cols is None:
+                    cols = len(lines.lstrip().split(b'\n', 1)[0].split())
+                table = np.fromstring(lines, dtype=np.int64, sep=' ')
+                if len(table) % cols:
+                    raise ValueError('%s: not a table of %d columns' %
+                                     (fname, cols))
+                yield table.reshape(-1, cols)
+            if not data:
+                break
+
+def count_lines(fname, chunk_size=1 << 24):
+    "Return the number of lines of a text file"
+    count = 0
+    last = b'\n'
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            count += chunk.count(b'\n')
+            last = chunk[-1:]
+    return count + (last != b'\n')
+
+
+# Upper limit of the header bytes a generator may add to the packet size
+MAX_HDR_LEN = 256
+
+def byte_seq_int(base, seq):
+    "Integer (or array) counterpart of byte_seq()"
+    return base + (seq // 254) * 256 + (seq % 254) + 1
+
+def table2array(table, attr, conv=None):
+    "Collect the `attr` column of a pipeline table into an array"
+    if isinstance(table, conf_tables.Table):
+        # Convert the stored column without creating the rows
+        col = attr if attr in table.types else attr.replace('_', '-')
+        typ = table.types.get(col)
+        if typ == 'const':
+            value = table.consts[col]
+            return np.full(len(table), conv(value) if conv else value,
+                           dtype=np.uint64)
+        if (typ, conv) in [('ip', ip2int), ('mac', mac2int),
+                           ('int', None), ('int', int)]:
+            return table.column(col).astype(np.uint64)
+    vals = [getattr(e, attr) for e in table]
+    if conv:
+        vals = [conv(v) for v in vals]
+    return np.array(vals, dtype=np.uint64)
+
+def ones_sum(data, odd=False):
+    """16-bit one's complement sum (not folded) of `data`.  If `odd` is
+    True, `data` starts at an odd offset relative to the checksummed
+    area."""
+    if odd:
+        data = b'\x00' + data
+    if len(data) % 2:
+        data = data + b'\x00'
+    return sum(struct.unpack('!%dH' % (len(data) // 2), bytes(data)))
+
+def fold(s):
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return s
+
+def ones_sum_batch(data, odd=False):
+    "Row-wise ones_sum() of the 2D uint8 array `data`"
+    data = data.astype(np.int64)
+    n = data.shape[0]
+    if odd:
+        data = np.hstack((np.zeros((n, 1), np.int64), data))
+    if data.shape[1] % 2:
+        data = np.hstack((data, np.zeros((n, 1), np.int64)))
+    return (data[:, 0::2] * 256 + data[:, 1::2]).sum(axis=1)
+
+def fold_batch(s):
+    while (s >> 16).any():
+        s = (s & 0xffff) + (s >> 16)
+    return s
+
+def encode_field_batch(values, size, encoding, n):
+    "Convert integer `values` to their wire format, one row per packet"
+    values = np.broadcast_to(np.asarray(values, dtype=np.uint64), (n,))
+    return values.astype('>u8').view(np.uint8).reshape(n, 8)[:, 8 - size:]
+
+def encap_fields(fields, outer):
+    """Adjust the paths of variable `fields` after the header stack
+    they refer to is encapsulated in the `outer` header stack."""
+    counts = {}
+    layer = outer
+    while layer:
+        name = layer.__class__.__name__
+        counts[name] = counts.get(name, 0) + 1
+        layer = layer.payload
+    ret = {}
+    for name, path in fields.items():
+        layer_id, field = path.split('.')
+        layer_name, _, occurrence = layer_id.partition(':')
+        occurrence = int(occurrence or 1) + counts.get(layer_name, 0)
+        ret[name] = '%s:%d.%s' % (layer_name, occurrence, field)
+    return ret
+
+
+class PktTemplate(object):
+    """A header stack serialized once.  Packets are synthesized by
+    copying the template and patching its variable fields.
+
+    `fields` maps field names to paths: 'Ether.src' is the src field
+    of the first Ether layer, 'IP:2.dst' is the dst field of the
+    second IP layer.  Checksums affected by the variable fields are
+    updated incrementally (RFC 1624).
+    """
+
+    def __init__(self, pkt, fields):
+        self.raw = bytearray(bytes(pkt))
+        layers = self._get_layers(pkt)
+        self.csums = self._get_checksums(layers)
+        self.fields = {}
+        for name, path in fields.items():
+            off, size, enc = self._resolve(layers, path)
+            self.fields[name] = (off, size, enc, self._get_deps(off, size))
+        for csum in self.csums:
+            csum['deps'] = self._get_deps(csum['offset'], 2)
+
+    def _get_layers(self, pkt):
+        "Return the list of (name, offset) of the layers of `pkt`"
+        layers = []
+        layer = pkt
+        while layer:
+            offset = len(self.raw) - len(bytes(layer))
+            layers.append((layer.__class__.__name__, offset))
+            layer = layer.payload
+        return layers
+
+    def _resolve(self, layers, path):
+        layer_id, field = path.split('.')
+        layer_name, _, occurrence = layer_id.partition(':')
+        occurrence = int(occurrence or 1)
+        offsets = [o for (n, o) in layers if n == layer_name]
+        try:
+            offset = offsets[occurrence - 1]
+            f_off, size, enc = FIELD_LAYOUT[(layer_name, field)]
+        except (IndexError, KeyError):
+            raise ValueError('unknown field: %s' % path)
+        return offset + f_off, size, enc
+
+    def _get_checksums(self, layers):
+        """Collect the checksums of the header stack ordered from the
+        innermost to the outermost one."""
+        csums = []
+        for i, (name, offset) in enumerate(layers):
+            if name != 'IP':
+                continue
+            raw = self.raw
+            hlen = (raw[offset] & 0xf) * 4
+            ip_end = offset + struct.unpack('!H', bytes(raw[offset+2:offset+4]))[0]
+            csums.append({'offset': offset + 10,
+                          'ranges': [(offset, offset + hlen)],
+                          'udp': False})
+            if i + 1 >= len(layers):
+                continue
+            l4_name, l4_offset = layers[i + 1]
+            csum_offset = {'UDP': 6, 'TCP': 16}.get(l4_name)
+            if csum_offset is None:
+                continue
+            csum_offset += l4_offset
+            if l4_name == 'UDP' and raw[csum_offset:csum_offset+2] == b'\0\0':
+                continue       # UDP checksum is disabled
+            pseudo_hdr = (offset + 12, offset + 20)  # src and dst addresses
+            csums.append({'offset': csum_offset,
+                          'ranges': [pseudo_hdr, (l4_offset, ip_end)],
+                          'udp': l4_name == 'UDP'})
+        csums.sort(key=lambda c: c['ranges'][-1][0], reverse=True)
+        for csum in csums:
+            csum['value'] = struct.unpack(
+                '!H', bytes(self.raw[csum['offset']:csum['offset']+2]))[0]
+        return csums
+
+    def _get_deps(self, offset, size):
+        """Return the checksums covering the area of [offset,
+        offset+size) as a list of (checksum index, parity)."""
+        deps = []
+        for idx, csum in enumerate(self.csums):
+            if csum['offset'] == offset:
+                continue
+            for start, end in csum['ranges']:
+                if start <= offset and offset + size <= end:
+                    deps.append((idx, (offset - start) % 2 == 1))
+                    break
+        return deps
+
+    def build_batch(self, values, n):
+        """Synthesize `n` packets at once.  `values` maps field names to
+        integer arrays (or scalars), MAC and IP addresses are given as
+        integers.  Return an (n, len(template)) uint8 array."""
+        raw = np.frombuffer(bytes(self.raw), dtype=np.uint8)
+        buf = np.empty((n, len(raw)), dtype=np.uint8)
+        buf[:] = raw
+        acc = [None] * len(self.csums)
+        for name, value in values.items():
+            off, size, enc, deps = self.fields[name]
+            new = encode_field_batch(value, size, enc, n)
+            buf[:, off:off+size] = new
+            old = bytes(self.raw[off:off+size])
+            for idx, odd in deps:
+                d = 0xffff - fold(ones_sum(old, odd)) + ones_sum_batch(new, odd)
+                acc[idx] = d if acc[idx] is None else acc[idx] + d
+        for idx, csum in enumerate(self.csums):
+            if acc[idx] is None:
+                continue
+            old = csum['value']
+            # RFC 1624, Eqn. 3: HC' = ~(~HC + ~m + m')
+            new = 0xffff - fold_batch((0xffff - old) + fold_batch(acc[idx]))
+            if csum['udp']:
+                new[new == 0] = 0xffff
+            off = csum['offset']
+            new = encode_field_batch(new, 2, 'int', n)
+            buf[:, off:off+2] = new
+            old = bytes(self.raw[off:off+2])
+            for idx2, odd in csum['deps']:
+                d = 0xffff - fold(ones_sum(old, odd)) + ones_sum_batch(new, odd)
+                acc[idx2] = d if acc[idx2] is None else acc[idx2] + d
+        return buf
+
+
+class PktRing(object):
+    """Fixed-size slots in shared memory to pass the packets of a job
+    from a worker to the writer without pickling them.  The free slots
+    are handed out via a queue; a slot is owned by the worker filling
+    it, then by the writer, until the writer returns it.
+
+    The memory is shared with the workers forked after the creation of
+    the ring."""
+
+    def __init__(self, slot_num, slot_size, snaplen):
+        self.slot_num = slot_num
+        self.slot_size = slot_size
+        self.snaplen = snaplen
+        pkts = slot_num * slot_size
+        self.mem = multiprocessing.RawArray('B', pkts * (8 + 4 + snaplen))
+        self.times = np.frombuffer(self.mem, dtype=np.float64, count=pkts)
+        self.times = self.times.reshape(slot_num, slot_size)
+        self.lens = np.frombuffer(self.mem, dtype=np.uint32, count=pkts,
+                                  offset=pkts * 8)
+        self.lens = self.lens.reshape(slot_num, slot_size)
+        self.data = np.frombuffer(self.mem, dtype=np.uint8,
+                                  count=pkts * snaplen, offset=pkts * 12)
+        self.data = self.data.reshape(slot_num, slot_size, snaplen)
+        self.free = multiprocessing.Queue()
+        for slot in range(slot_num):
+            self.free.put(slot)
+
+    def get_slot(self):
+        return self.free.get()
+
+    def put_slot(self, slot):
+        self.free.put(slot)
+
+    def store(self, slot, buf, lens, timestamp):
+        """Copy the packets of a job into `slot`, `timestamp` is a scalar
+        or an array"""
+        n, width = buf.shape
+        if width > self.snaplen:
+            raise ValueError('packet too long (%d > %d)' % (width, self.snaplen))
+        self.data[slot, :n, :width] = buf
+        self.lens[slot, :n] = lens
+        self.times[slot, :n] = timestamp
+
+    def pkts(self, slot, count):
+        "Return the packets of `slot` as a list of bytes"
+        return [self.data[slot, i, :l].tobytes()
+                for i, l in enumerate(self.lens[slot, :count])]
+
+
+class Profile(object):
+    """Wall-clock and CPU time spent in the stages of a process, and
+    samples of queue depths.  Does nothing unless `enabled`."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.queues = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            s = self.stages.setdefault(name, [0, 0.0, 0.0])
+            s[0] += 1
+            s[1] += time.perf_counter() - wall
+            s[2] += time.process_time() - cpu
+
+    def sample(self, name, depth):
+        "Record the current `depth` of queue `name`"
+        if not self.enabled:
+            return
+        if callable(depth):
+            try:
+                depth = depth()
+            except NotImplementedError:
+                # Queue.qsize() is not available on macOS
+                return
+        q = self.queues.setdefault(name, [0, 0, 0])
+        q[0] += 1
+        q[1] += depth
+        q[2] = max(q[2], depth)
+
+    def as_dict(self):
+        return {
+            'stages': {name: {'count': n, 'wall-time': round(wall, 6),
+                              'cpu-time': round(cpu, 6)}
+                       for name, (n, wall, cpu) in self.stages.items()},
+            'queues': {name: {'samples': n, 'mean': round(total / n, 3),
+                              'max': max_depth}
+                       for name, (n, total, max_depth) in self.queues.items()},
+        }
+
+
+class PcapFile(object):
+    """Write packets in the libpcap file format (Ethernet, usec timestamps)
+
+    The file is compressed unless `compression` is 'none'.
+    """
+
+    def __init__(self, fname, compression='none'):
+        if compression == 'none':
+            self.f = open(fname, 'wb')
+        else:
+            self.f = pcap_compress.open_writer(fname, compression)
+        self.f.write(struct.pack('IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+
+    def records(self, ring, slot, idxs):
+        "Return packets `idxs` of a ring slot as pcap records"
+        recs = []
+        data, lens, times = ring.data[slot], ring.lens[slot], ring.times[slot]
+        for i in idxs:
+            l = int(lens[i])
+            sec = int(times[i])
+            usec = int(round((times[i] - sec) * 1000000))
+            recs.append(struct.pack('IIII', sec, usec, l, l))
+            recs.append(data[i, :l].tobytes())
+        return b''.join(recs)
+
+    def write(self, records):
+        self.f.write(records)
+
+    def close(self):
+        self.f.close()
+
+
+class AliasTable(object):
+    "Walker's alias method: O(1) sampling from a discrete distribution"
+
+    def __init__(self, weights):
+        n = len(weights)
+        weights = np.asarray(weights, dtype=np.float64)
+        prob = (weights * n / weights.sum()).tolist()
+        alias = list(range(n))
+        small = [i for i, p in enumerate(prob) if p < 1]
+        large = [i for i, p in enumerate(prob) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large[-1]
+            alias[s] = l
+            prob[l] += prob[s] - 1
+            if prob[l] < 1:
+                small.append(large.pop())
+        for i in small + large:
+            prob[i] = 1.0
+        self.prob = np.array(prob)
+        self.alias = np.array(alias, dtype=np.int64)
+
+    def sample(self, size, rng):
+        idx = rng.randint(len(self.prob), size=size)
+        keep = rng.random_sample(size) < self.prob[idx]
+        return np.where(keep, idx, self.alias[idx])
+
+
+class FlowDist(object):
+    """Popularity distribution of the flows.
+
+    `spec` is one of 'uniform', 'zipf[:s]' (the weight of the flow of
+    rank i is 1/i^s), 'pareto[:a]' (i.i.d. Pareto weights of shape a)
+    or 'hot-set:k[:p]' (the k most popular flows receive p fraction of
+    the packets).  Flow 0 is the most popular one.
+    """
+
+    defaults = {'uniform': [], 'zipf': [1.0], 'pareto': [1.16],
+                'hot-set': [None, 0.9]}
+
+    def __init__(self, spec):
+        self.spec = spec
+        name, _, params = spec.partition(':')
+        if name not in self.defaults:
+            raise ValueError('unknown flow distribution: %s' % spec)
+        params = [float(p) for p in params.split(':') if p]
+        self.name = name
+        self.params = params + self.defaults[name][len(params):]
+        if None in self.params:
+            raise ValueError('missing parameter of flow distribution: %s'
+                             % spec)
+        self.alias_tables = {}
+
+    def is_uniform(self):
+        return self.name == 'uniform'
+
+    def weights(self, n):
+        if self.name == 'uniform':
+            return np.ones(n)
+        if self.name == 'zipf':
+            return np.arange(1, n + 1, dtype=np.float64) ** -self.params[0]
+        if self.name == 'pareto':
+            # Fixed seed: every worker has to compute the same weights
+            w = np.random.RandomState(0).pareto(self.params[0], n) + 1
+            return np.sort(w)[::-1]
+        if self.name == 'hot-set':
+            k = min(int(self.params[0]), n)
+            p = self.params[1] if k < n else 1.0
+            w = np.full(n, (1 - p) / max(n - k, 1))
+            w[:k] = p / k
+            return w
+
+    def sample(self, n, size, rng):
+        "Return `size` flow indices from range(n)"
+        if self.is_uniform():
+            return rng.randint(n, size=size)
+        try:
+            table = self.alias_tables[n]
+        except KeyError:
+            table = self.alias_tables[n] = AliasTable(self.weights(n))
+        return table.sample(size, rng)
+
+
+class SizeDist(object):
+    "Weighted packet sizes"
+
+    def __init__(self, sizes, weights):
+        self.sizes = sizes
+        self.weights = weights
+        self.alias_table = AliasTable(weights) if len(sizes) > 1 else None
 
+    def sample(self, size, rng):
+        "Return `size` indices of self.sizes"
+        if self.alias_table is None:
+            return np.zeros(size, dtype=np.int64)
+        return self.alias_table.sample(size, rng)
 
-class PicklablePacket(object):
-    """A container for scapy packets that can be pickled (in contrast
-    to scapy packets themselves). https://stackoverflow.com/a/4312192"""
 
-    __slots__ = ['contents', 'time']
+class PktSizeDist(object):
+    """Packet size distribution given by the pkt-size traffic option.
 
-    def __init__(self, pkt):
-        self.contents = bytes(pkt)
-        self.time = pkt.time
+    `spec` is either a packet size, a standard mix ('imix' or
+    'imix-tolly'), a weighted list of sizes ('64:7,570:4,1518:1'), or
+    per-protocol settings ('tcp=imix;udp=128;64'), where the setting
+    without a protocol applies to the rest of the protocols.
+    """
+
+    mixes = {
+        'imix': '64:7,570:4,1518:1',
+        'imix-tolly': '64:55,78:5,576:17,1518:23',
+    }
+    protos = ('tcp', 'udp', 'other')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.dists = {}
+        for part in str(spec).split(';'):
+            proto, _, dist = part.rpartition('=')
+            if proto and proto not in self.protos:
+                raise ValueError('unknown protocol in pkt-size: %s' % proto)
+            self.dists[proto or None] = self._parse(dist)
+
+    def _parse(self, dist):
+        dist = self.mixes.get(dist, dist)
+        sizes, weights = [], []
+        try:
+            for item in dist.split(','):
+                size, _, weight = item.partition(':')
+                sizes.append(int(size))
+                weights.append(float(weight or 1))
+        except ValueError:
+            raise ValueError('invalid pkt-size: %s' % self.spec)
+        return SizeDist(sizes, weights)
 
-    def __call__(self):
-        """Get the original scapy packet."""
-        pkt = Ether(self.contents)
-        pkt.time = self.time
-        return pkt
+    def get(self, pkt):
+        "Return the SizeDist of header stack `pkt`"
+        proto = 'other'
+        layer = pkt
+        while layer:
+            name = layer.__class__.__name__
+            if name in ('TCP', 'UDP'):
+                proto = name.lower()
+            layer = layer.payload
+        dist = self.dists.get(proto, self.dists.get(None))
+        if dist is None:
+            raise ValueError('pkt-size is not set for %s' % proto)
+        return dist
+
+    def max_size(self):
+        return max(max(d.sizes) for d in self.dists.values())
+
+
+class FlowTable(object):
+    """Variable header fields of `flow_num` flows, the fields of flow i
+    are the fields gen_fields_batch() returns for pkt_idx i."""
+
+    def __init__(self, gen_pkt, flow_num, chunk_size=65536):
+        self.flow_num = flow_num
+        self.keys = []
+        self.values = []
+        self.flow_key = np.zeros(flow_num, dtype=np.int64)
+        self.flow_pos = np.zeros(flow_num, dtype=np.int64)
+        parts = []
+        for start in range(0, flow_num, chunk_size):
+            idxs = np.arange(start, min(start + chunk_size, flow_num))
+            for key, sel, cnt, values in gen_pkt.gen_fields_batch(idxs):
+                if key not in self.keys:
+                    self.keys.append(key)
+                    parts.append([])
+                k = self.keys.index(key)
+                flows = idxs[sel]
+                offset = sum(len(p[0]) for p in parts[k])
+                self.flow_key[flows] = k
+                self.flow_pos[flows] = offset + np.arange(cnt)
+                values = {name: np.broadcast_to(v, (cnt,))
+                          for name, v in values.items()}
+                parts[k].append((flows, values))
+        for part in parts:
+            names = part[0][1].keys()
+            self.values.append({name: np.concatenate([p[1][name]
+                                                      for p in part])
+                                for name in names})
+
+    def gen_fields_batch(self, flows):
+        "Return the fields of `flows` like GenPkt.gen_fields_batch()"
+        flow_key = self.flow_key[flows]
+        flow_pos = self.flow_pos[flows]
+        groups = []
+        for k, key in enumerate(self.keys):
+            sel = np.flatnonzero(flow_key == k)
+            if len(sel) == 0:
+                continue
+            pos = flow_pos[sel]
+            values = {name: v[pos] for name, v in self.values[k].items()}
+            groups.append((key, sel, len(sel), values))
+        return groups
 
 
 class GenPkt(object):
-    def __init__(self, args, conf, in_que, out_que):
+    """Base class of the packet generators.
+
+    A subclass either builds whole packets in gen_pkt(), or opts in
+    for template-based packet synthesis by setting `use_template` and
+    implementing gen_template() and gen_fields_batch() (or gen_fields(),
+    which the default gen_fields_batch() calls packet by packet).
+    """
+
+    use_template = False
+
+    def __init__(self, args, conf, in_que, out_que, ring=None):
         self.args = args
         self.conf = conf
         self.in_que = in_que
         self.out_que = out_que
+        self.ring = ring
+        self.templates = {}
+        # The parent process uses the stream of job -1
+        self.seed = args.random_seed or random.randrange(2 ** 32)
+        self.rng = np.random.RandomState(job_seed(self.seed, -1))
+        self.flow_dist = FlowDist(args.flow_distribution)
+        self.flows = None
+        self.pkt_size = PktSizeDist(args.pkt_size)
+        self.size_dists = {}
+
+    def prepare(self):
+        """Precompute state shared by the workers.  Called once before
+        the workers are started."""
+        self.check_pkt_size()
+        if self.use_template and not self.flow_dist.is_uniform():
+            self.flows = FlowTable(self, self.get_flow_num())
+
+    def check_pkt_size(self):
+        """Build the templates of every packet size, so that an invalid
+        pkt-size setting fails here instead of in the workers"""
+        if not self.use_template:
+            return
+        for key in self.template_keys():
+            for size in self.get_size_dist(key).sizes:
+                self.get_template(key, size)
 
     def create_work_items(self, job_size):
+        "Yield the jobs (with consecutive job_idx values) lazily"
         pkt_num = self.get_pkt_num()
-        pkt_idx = list(range(pkt_num))
-        random.shuffle(pkt_idx)
-        items = []
-        for job_idx, pkt_idxs in enumerate(grouper(job_size, pkt_idx)):
-            pkt_idxs = [idx for idx in pkt_idxs if idx is not None]
-            items.append({'job_idx': job_idx, 'pkt_idxs': pkt_idxs})
-        return items
-
-    def do_work(self):
+        pkt_idx = shuffled_range(pkt_num, job_size)
+        for job_idx, pkt_idxs in enumerate(pkt_idx):
+            yield {'job_idx': job_idx, 'pkt_idxs': pkt_idxs}
+
+    def do_work(self, worker_idx=0):
+        prof = Profile(self.args.profile != 'none')
+        if self.args.profile == 'cprofile':
+            import cProfile
+            cprof = cProfile.Profile()
+            cprof.enable()
         try:
             while True:
-                item = self.in_que.get()
+                # Take a slot first, so that a job taken from the
+                # queue always has a place to be stored.
+                with prof.stage('slot-wait'):
+                    slot = self.ring.get_slot()
+                prof.sample('in-queue', self.in_que.qsize)
+                with prof.stage('job-wait'):
+                    item = self.in_que.get()
                 if item is None:
                     break
-                pkt_idxs = item['pkt_idxs']
-                pkts = [PicklablePacket(self.gen_pkt(idx)) for idx in pkt_idxs]
-                item['pkts'] = pkts
+                with prof.stage('generate'):
+                    buf, lens = self.gen_job(item)
+                with prof.stage('store'):
+                    # Nominal timestamps: 1 usec between the packets
+                    times = (item['pkt_offset'] + np.arange(len(lens))) * 1e-6
+                    self.ring.store(slot, buf, lens, times)
+                item['slot'] = slot
+                item['count'] = len(lens)
                 del item['pkt_idxs']
-                self.out_que.put(item)
+                with prof.stage('result-put'):
+                    self.out_que.put(item)
+            if prof.enabled:
+                if self.args.profile == 'cprofile':
+                    cprof.disable()
+                    cprof.dump_stats('%s.worker-%d.prof' %
+                                     (profile_fname(self.args), worker_idx))
+                self.out_que.put(dict(prof.as_dict(), worker=worker_idx))
         except Exception as e:
             item = {'exception': e, 'traceback': traceback.format_exc()}
             self.out_que.put(item)
             return True
 
+    def gen_job(self, item):
+        "Generate the packets of job `item`, see gen_batch()"
+        self.seed_job(item['job_idx'])
+        return self.gen_batch(item['pkt_idxs'])
+
+    def seed_job(self, job_idx):
+        """Switch to the random streams of job `job_idx` (both self.rng
+        and the `random` module), so that the output does not depend on
+        the number of workers and the scheduling of the jobs."""
+        self.rng = np.random.RandomState(job_seed(self.seed, job_idx))
+        random.seed(int(self.rng.randint(2 ** 31)))
+
     def gen_pkt(self, pkt_idx):
+        """Return packet `pkt_idx` as a header stack (see pkt_hdr), only
+        called if `use_template` is not set"""
         raise NotImplementedError
 
+    def gen_raw_pkt(self, pkt_idx):
+        "Return packet `pkt_idx` in its wire format"
+        if not self.use_template:
+            return bytes(self.gen_pkt(pkt_idx))
+        buf, lens = self.gen_batch([pkt_idx])
+        return buf[0, :lens[0]].tobytes()
+
+    def template_keys(self):
+        "Return the keys of the templates the generator might use"
+        return [None]
+
+    def gen_template(self, key):
+        """Return the header stack identified by `key` (see pkt_hdr) and
+        a dict of the field paths of its variable fields (see
+        PktTemplate)."""
+        raise NotImplementedError
+
+    def gen_fields(self, pkt_idx):
+        """Return the template key and the values of the variable fields
+        of packet `pkt_idx`.  Only needed if gen_fields_batch() is not
+        overridden."""
+        raise NotImplementedError
+
+    def gen_batch(self, pkt_idxs):
+        """Return packets `pkt_idxs` as a 2D uint8 array (one zero padded
+        row per packet) and an array of the packet lengths."""
+        n = len(pkt_idxs)
+        if not self.use_template:
+            pkts = [self.gen_raw_pkt(idx) for idx in pkt_idxs]
+            parts = [(i, np.frombuffer(bytes(p), dtype=np.uint8)[None, :])
+                     for i, p in enumerate(pkts)]
+        else:
+            if self.flows:
+                flows = self.flow_dist.sample(self.flows.flow_num, n,
+                                              self.rng)
+                groups = self.flows.gen_fields_batch(flows)
+            else:
+                groups = self.gen_fields_batch(pkt_idxs)
+            parts = []
+            for key, sel, cnt, values in groups:
+                idxs = np.arange(n)[sel]
+                for sub, part in self.build_group(key, cnt, values):
+                    parts.append((idxs[sub], part))
+        width = max([p.shape[1] for _, p in parts] or [0])
+        buf = np.zeros((n, width), dtype=np.uint8)
+        lens = np.zeros(n, dtype=np.int64)
+        for sel, part in parts:
+            buf[sel, :part.shape[1]] = part
+            lens[sel] = part.shape[1]
+        return buf, lens
+
+    def build_group(self, key, cnt, values):
+        """Build a group of packets returned by gen_fields_batch().
+        Yield (selector within the group, packets) tuples, one for each
+        packet size."""
+        dist = self.get_size_dist(key)
+        if len(dist.sizes) == 1:
+            yield slice(None), self.get_template(key).build_batch(values, cnt)
+            return
+        size_idx = dist.sample(cnt, self.rng)
+        for i, size in enumerate(dist.sizes):
+            sel = np.flatnonzero(size_idx == i)
+            if len(sel) == 0:
+                continue
+            vals = {name: np.broadcast_to(v, (cnt,))[sel]
+                    for name, v in values.items()}
+            tmpl = self.get_template(key, size)
+            yield sel, tmpl.build_batch(vals, len(sel))
+
+    def gen_fields_batch(self, pkt_idxs):
+        """Return the variable fields of packets `pkt_idxs` grouped by
+        template keys as a list of (key, selector, count, values)
+        tuples: `selector` selects the packets of the group in the batch
+        and `values` maps field names to integer arrays.
+
+        Subclasses should override this with a vectorized version, this
+        default collects the values of gen_fields() packet by packet.
+        """
+        groups = {}
+        for i, idx in enumerate(pkt_idxs):
+            key, values = self.gen_fields(idx)
+            sel, vals = groups.setdefault(key, ([], {}))
+            sel.append(i)
+            for name, value in values.items():
+                vals.setdefault(name, []).append(value)
+        ret = []
+        for key, (sel, vals) in groups.items():
+            tmpl = self.get_template(key)
+            for name, value in vals.items():
+                enc = tmpl.fields[name][2]
+                conv = {'mac': mac2int, 'ip': ip2int}.get(enc)
+                if conv:
+                    value = [conv(v) if isinstance(v, str) else v
+                             for v in value]
+                vals[name] = np.array(value, dtype=np.uint64)
+            ret.append((key, np.array(sel), len(sel), vals))
+        return ret
+
+    def get_template(self, key, size=None):
+        """Return the template of `key` padded to `size` (by default, the
+        first size of the pkt-size setting of the template)"""
+        if size is None:
+            size = self.get_size_dist(key).sizes[0]
+        try:
+            return self.templates[key, size]
+        except KeyError:
+            pkt, fields = self.gen_template(key)
+            pkt = self.add_payload(pkt, size)
+            pkt, fields = self.encap(pkt, fields)
+            self.templates[key, size] = PktTemplate(pkt, fields)
+            return self.templates[key, size]
+
+    def get_size_dist(self, key):
+        "Return the packet size distribution of template `key`"
+        try:
+            return self.size_dists[key]
+        except KeyError:
+            pkt, _ = self.gen_template(key)
+            self.size_dists[key] = self.pkt_size.get(pkt)
+            return self.size_dists[key]
+
+    def encap(self, pkt, fields):
+        """Encapsulate the padded packet `pkt`, return the new packet and
+        the adjusted field paths (see encap_fields())."""
+        return pkt, fields
+
+    def get_max_pkt_len(self):
+        "Upper limit of the length of the generated packets"
+        return self.pkt_size.max_size() + MAX_HDR_LEN
+
     def get_pkt_num(self):
         "Return the number of packets to be generated"
         if self.args.pkt_num:
@@ -94,15 +876,130 @@ class GenPkt(object):
     def get_auto_pkt_num(self):
         raise NotImplementedError
 
+    def get_flow_num(self):
+        "Return the number of distinct flows in the traffic"
+        if self.args.flow_num:
+            return self.args.flow_num
+        return self.get_auto_pkt_num()
+
     @staticmethod
     def add_payload(p, pkt_size):
         if len(p) < pkt_size:
-            #"\x00" is a single zero byte
-            s = "\x00" * (pkt_size - len(p))
-            p = p / Raw(s)
+            p = p / Raw(b'\x00' * (pkt_size - len(p)))
         return p
 
     def get_other_direction(self):
         return {'u': 'd', 'd': 'u'}[self.args.dir[0]]
 
 
+def profile_fname(args):
+    "Prefix of the profile outputs: the pcap, or gen_pcap for devices"
+    if args.output.name.startswith('/dev/'):
+        return 'gen_pcap'
+    return args.output.name
+
+def downlink_fname(fname):
+    "traffic.pcap -> traffic.downlink.pcap"
+    if fname.endswith('.pcap'):
+        return fname[:-len('.pcap')] + '.downlink.pcap'
+    return fname + '.downlink'
+
+
+class IdxStream(object):
+    "Take the pkt_idxs of the work items of a generator in any amounts"
+
+    def __init__(self, gen_pkt, job_size):
+        self.gen_pkt = gen_pkt
+        self.job_size = job_size
+        self.items = iter([])
+        self.buf = []
+
+    def _next_chunk(self):
+        try:
+            return next(self.items)['pkt_idxs']
+        except StopIteration:
+            # Start over, e.g., the fw pipeline ignores pkt-num
+            self.items = self.gen_pkt.create_work_items(self.job_size)
+            return next(self.items)['pkt_idxs']
+
+    def take(self, n):
+        while sum(len(c) for c in self.buf) < n:
+            self.buf.append(self._next_chunk())
+        if self.buf and isinstance(self.buf[0], np.ndarray):
+            idxs = np.concatenate(self.buf)
+        else:
+            idxs = [i for c in self.buf for i in c]
+        self.buf = [idxs[n:]]
+        return idxs[:n]
+
+
+class BidirGenPkt(GenPkt):
+    """Interleaved uplink and downlink traffic of a pipeline.
+
+    The packets of the two directions are generated by two instances of
+    the pipeline's generator.  Packet p is an uplink packet if
+    floor((p + 1) * r) > floor(p * r), where r is the bidir-ratio, the
+    fraction of the uplink packets.
+    """
+
+    use_template = True
+
+    def __init__(self, gen_pkt_class, args, conf, in_que, out_que, ring=None):
+        super(BidirGenPkt, self).__init__(args, conf, in_que, out_que, ring)
+        self.ratio = args.bidir_ratio
+        self.gens = []
+        for i, direction in enumerate(['uplink', 'downlink']):
+            gen_args = copy.copy(args)
+            gen_args.dir = direction
+            gen = gen_pkt_class(gen_args, conf, in_que, out_que, ring)
+            gen.seed = int(job_seed(self.seed, -2 - i)[0])
+            gen.rng = np.random.RandomState(job_seed(gen.seed, -1))
+            self.gens.append(gen)
+
+    def prepare(self):
+        for gen in self.gens:
+            gen.prepare()
+
+    def get_dirs(self, start, stop):
+        "Return the uplink mask of packets range(start, stop)"
+        p = np.arange(start, stop)
+        return np.floor((p + 1) * self.ratio) > np.floor(p * self.ratio)
+
+    def create_work_items(self, job_size):
+        pkt_num = self.get_pkt_num()
+        uplink_num = int(self.get_dirs(0, pkt_num).sum())
+        streams = []
+        for gen, num in zip(self.gens, [uplink_num, pkt_num - uplink_num]):
+            gen.args.pkt_num = num
+            streams.append(IdxStream(gen, job_size))
+        for job_idx, start in enumerate(range(0, pkt_num, job_size)):
+            stop = min(start + job_size, pkt_num)
+            dirs = self.get_dirs(start, stop)
+            up = int(dirs.sum())
+            yield {'job_idx': job_idx, 'dirs': dirs,
+                   'pkt_idxs': np.arange(start, stop),
+                   'sub_idxs': [streams[0].take(up),
+                                streams[1].take(len(dirs) - up)]}
+
+    def gen_job(self, item):
+        dirs = item['dirs']
+        parts = []
+        for gen, sel, idxs in zip(self.gens, [dirs, ~dirs],
+                                  item.pop('sub_idxs')):
+            if len(idxs) == 0:
+                continue
+            gen.seed_job(item['job_idx'])
+            parts.append((np.flatnonzero(sel), gen.gen_batch(idxs)))
+        width = max(buf.shape[1] for _, (buf, _) in parts)
+        buf = np.zeros((len(dirs), width), dtype=np.uint8)
+        lens = np.zeros(len(dirs), dtype=np.int64)
+        for sel, (part, part_lens) in parts:
+            buf[sel, :part.shape[1]] = part
+            lens[sel] = part_lens
+        return buf, lens
+
+    def get_auto_pkt_num(self):
+        return sum(gen.get_auto_pkt_num() for gen in self.gens)
+
+    def get_max_pkt_len(self):
+        return max(gen.get_max_pkt_len() for gen in self.gens)
@@ -16,7 +16,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import json
+
+try:
+  import conf_tables
+except ImportError:
+  from . import conf_tables
 
 class ObjectView(object):
   def __init__(self, **kwargs):
@@ -42,7 +46,7 @@ class ObjectWithConfig(object):
     try:
       with open(fname, 'r') as f:
         conv_fn = lambda d: ObjectView(**d)
-        config = json.load(f, object_hook=conv_fn)
+        config = conf_tables.load(f, object_hook=conv_fn)
     except IOError as e:
       self.logger.error('Failed to load cfg file (%s): %s' %
                         (fname, e))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""zstd/lz4 compression of pcap files.
+
+A compressed file is a single standard zstd or lz4 frame, so the zstd
+and lz4 command line tools can decompress it as well.  The Testers
+replay uncompressed pcaps only (they read them repeatedly), so a
+compressed pcap is decompressed to a file before the measurement:
+compression saves space where the pcaps are stored (the measurement
+directories and the cache), but not during the measurement.
+
+Usage:
+  pcap_compress.py compress -c zstd traffic.pcap traffic.pcap.zst
+  pcap_compress.py decompress traffic.pcap.zst traffic.pcap
+"""
+
+import argparse
+import os
+import shutil
+
+__all__ = ['CODECS', 'detect', 'open_writer', 'open_pcap',
+           'decompress_file', 'compress_file']
+
+CODECS = ['zstd', 'lz4']
+FRAME_MAGIC = {b'\x28\xb5\x2f\xfd': 'zstd', b'\x04\x22\x4d\x18': 'lz4'}
+
+
+def import_codec(name):
+    "Return the python module of codec `name`"
+    if name == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('zstd compression requires the zstandard '
+                              'python package (pip3 install zstandard)')
+        return zstandard
+    if name == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ImportError('lz4 compression requires the lz4 '
+                              'python package (pip3 install lz4)')
+        return lz4.frame
+    raise ValueError('unknown compression: %s' % name)
+
+def detect(fname):
+    "Return the codec of compressed file `fname`, None if not compressed"
+    if not os.path.isfile(str(fname)):
+        # Do not consume the data of named pipes
+        return None
+    with open(str(fname), 'rb') as f:
+        return FRAME_MAGIC.get(f.read(4))
+
+def open_writer(fname, codec):
+    "Open `fname` for writing, compressed with `codec`"
+    module = import_codec(codec)
+    if codec == 'lz4':
+        return module.open(str(fname), 'wb')
+    return module.ZstdCompressor().stream_writer(open(str(fname), 'wb'))
+
+def open_pcap(fname):
+    "Open `fname` for reading, decompress it on the fly if necessary"
+    codec = detect(fname)
+    if codec is None:
+        return open(str(fname), 'rb')
+    module = import_codec(codec)
+    if codec == 'lz4':
+        return module.open(str(fname), 'rb')
+    return module.ZstdDecompressor().stream_reader(open(str(fname), 'rb'))
+
+def decompress_file(src, dst):
+    "Decompress `src` to `dst`"
+    with open_pcap(src) as inp, open(str(dst), 'wb') as out:
+        shutil.copyfileobj(inp, out, 1 << 20)
+
+def compress_file(src, dst, codec):
+    "Compress `src` to `dst` with `codec` (zstd or lz4)"
+    with open(str(src), 'rb') as inp, open_writer(dst, codec) as out:
+        shutil.copyfileobj(inp, out, 1 << 20)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['compress', 'decompress'])
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--codec', '-c', choices=CODECS, default='zstd',
+                        help='Compression codec (default: zstd)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'compress':
+        compress_file(args.input, args.output, args.codec)
+    else:
+        decompress_file(args.input, args.output)
@@ -0,0 +1,283 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Native encoders of the packet headers used by the traffic generators.
+
+The layers follow the scapy conventions the generators rely on: they
+are stacked with '/', the layers of a stack are linked by `payload`,
+and bytes() returns the wire format with the lengths, protocol numbers
+and checksums filled in:
+
+  bytes(Ether(dst='aa:bb:cc:dd:ee:ff') / IP(dst='1.2.3.4') / UDP())
+"""
+
+import socket
+import struct
+
+__all__ = ['Ether', 'IP', 'UDP', 'TCP', 'VXLAN', 'GTPHeader', 'Raw',
+           'FIELD_LAYOUT', 'checksum']
+
+
+def checksum(data):
+    "Internet checksum (RFC 1071) of `data`"
+    if len(data) % 2:
+        data = bytes(data) + b'\x00'
+    s = sum(struct.unpack('!%dH' % (len(data) // 2), bytes(data)))
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return 0xffff - s
+
+def encode(value, size, encoding):
+    "Convert `value` (a MAC/IP address string or an integer) to bytes"
+    if encoding == 'mac' and isinstance(value, str):
+        return bytes.fromhex(value.replace(':', ''))
+    if encoding == 'ip' and isinstance(value, str):
+        return socket.inet_aton(value)
+    if encoding == 'raw':
+        return bytes(value)
+    return int(value).to_bytes(size, 'big')
+
+
+class NoPayload(object):
+    "The end of a header stack"
+
+    def __bool__(self):
+        return False
+
+    def __len__(self):
+        return 0
+
+    def build(self, underlayer):
+        return b''
+
+    def copy(self):
+        return self
+
+
+class Layer(object):
+    """A protocol header.
+
+    `fields_desc` lists the fields of the header in wire order as
+    (name, size in bytes, encoding, default value) tuples, where the
+    encoding is 'mac', 'ip', 'int' or 'raw'.  Fields with a default of
+    None are computed by post_build() unless they are set explicitly.
+    """
+
+    fields_desc = []
+
+    def __init__(self, **kw):
+        names = [f[0] for f in self.fields_desc]
+        for name in kw:
+            if name not in names:
+                raise TypeError('%s has no field %s' %
+                                (self.__class__.__name__, name))
+        self.fields = dict(kw)
+        self.payload = NoPayload()
+
+    def __truediv__(self, other):
+        if isinstance(other, (bytes, str)):
+            other = Raw(other)
+        ret = self.copy()
+        last = ret
+        while last.payload:
+            last = last.payload
+        last.payload = other.copy()
+        return ret
+
+    def __bool__(self):
+        return True
+
+    def __bytes__(self):
+        return self.build(None)
+
+    def __len__(self):
+        return len(bytes(self))
+
+    def __repr__(self):
+        fields = ' '.join('%s=%s' % i for i in sorted(self.fields.items()))
+        ret = '<%s %s>' % (self.__class__.__name__, fields)
+        if self.payload:
+            ret += ' / %r' % self.payload
+        return ret
+
+    def copy(self):
+        "Return a copy of the header stack starting with self"
+        ret = self.__class__.__new__(self.__class__)
+        ret.fields = dict(self.fields)
+        ret.payload = self.payload.copy()
+        return ret
+
+    def getfield(self, name):
+        "Return the value of field `name` (None: to be computed)"
+        for fname, _, _, default in self.fields_desc:
+            if fname == name:
+                return self.fields.get(name, default)
+        raise KeyError(name)
+
+    def encode_field(self, name):
+        "Return the wire format of field `name`"
+        for fname, size, enc, default in self.fields_desc:
+            if fname == name:
+                value = self.fields.get(name, default)
+                return encode(0 if value is None else value, size, enc)
+        raise KeyError(name)
+
+    def build(self, underlayer):
+        "Return the wire format of the header stack starting with self"
+        pay = self.payload.build(self)
+        hdr = bytearray()
+        offsets = {}
+        for name, _, _, _ in self.fields_desc:
+            offsets[name] = len(hdr)
+            hdr += self.encode_field(name)
+        self.post_build(hdr, offsets, pay, underlayer)
+        return bytes(hdr) + pay
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        "Fill in the computed fields of header `hdr`"
+        pass
+
+    def set_computed(self, hdr, offsets, name, value):
+        "Set field `name` in `hdr` to `value` unless it is set explicitly"
+        if self.getfield(name) is not None:
+            return
+        size = [f[1] for f in self.fields_desc if f[0] == name][0]
+        off = offsets[name]
+        hdr[off:off + size] = encode(value, size, 'int')
+
+    def l4_checksum(self, hdr, offsets, pay, underlayer, proto):
+        "Set the checksum of a TCP or UDP header (pseudo header: IPv4)"
+        if not isinstance(underlayer, IP):
+            return
+        length = len(hdr) + len(pay)
+        pseudo = (underlayer.encode_field('src') +
+                  underlayer.encode_field('dst') +
+                  struct.pack('!BBH', 0, proto, length))
+        csum = checksum(pseudo + bytes(hdr) + pay)
+        if proto == 17 and csum == 0:
+            csum = 0xffff
+        self.set_computed(hdr, offsets, 'chksum', csum)
+
+
+class Ether(Layer):
+    fields_desc = [
+        ('dst', 6, 'mac', 'ff:ff:ff:ff:ff:ff'),
+        ('src', 6, 'mac', '00:00:00:00:00:00'),
+        ('type', 2, 'int', None),
+    ]
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        ether_type = 0x0800 if isinstance(self.payload, IP) else 0x9000
+        self.set_computed(hdr, offsets, 'type', ether_type)
+
+
+class IP(Layer):
+    fields_desc = [
+        ('version_ihl', 1, 'int', 0x45),
+        ('tos', 1, 'int', 0),
+        ('len', 2, 'int', None),
+        ('id', 2, 'int', 1),
+        ('flags_frag', 2, 'int', 0),
+        ('ttl', 1, 'int', 64),
+        ('proto', 1, 'int', None),
+        ('chksum', 2, 'int', None),
+        ('src', 4, 'ip', '127.0.0.1'),
+        ('dst', 4, 'ip', '127.0.0.1'),
+    ]
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        self.set_computed(hdr, offsets, 'len', len(hdr) + len(pay))
+        proto = {TCP: 6, UDP: 17}.get(type(self.payload), 0)
+        self.set_computed(hdr, offsets, 'proto', proto)
+        self.set_computed(hdr, offsets, 'chksum', checksum(hdr))
+
+
+class UDP(Layer):
+    fields_desc = [
+        ('sport', 2, 'int', 53),
+        ('dport', 2, 'int', 53),
+        ('len', 2, 'int', None),
+        ('chksum', 2, 'int', None),
+    ]
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        self.set_computed(hdr, offsets, 'len', len(hdr) + len(pay))
+        self.l4_checksum(hdr, offsets, pay, underlayer, 17)
+
+
+class TCP(Layer):
+    fields_desc = [
+        ('sport', 2, 'int', 20),
+        ('dport', 2, 'int', 80),
+        ('seq', 4, 'int', 0),
+        ('ack', 4, 'int', 0),
+        ('dataofs', 1, 'int', 0x50),   # 20 bytes, no options
+        ('flags', 1, 'int', 0x02),     # SYN
+        ('window', 2, 'int', 8192),
+        ('chksum', 2, 'int', None),
+        ('urgptr', 2, 'int', 0),
+    ]
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        self.l4_checksum(hdr, offsets, pay, underlayer, 6)
+
+
+class VXLAN(Layer):
+    "VXLAN header (RFC 7348)"
+
+    fields_desc = [
+        ('flags', 1, 'int', 0x08),     # valid VNI
+        ('reserved1', 3, 'int', 0),
+        ('vni', 3, 'int', 0),
+        ('reserved2', 1, 'int', 0),
+    ]
+
+
+class GTPHeader(Layer):
+    "GTP-U header (3GPP TS 29.281) of a G-PDU without optional fields"
+
+    fields_desc = [
+        ('flags', 1, 'int', 0x30),     # version 1, PT: GTP
+        ('gtp_type', 1, 'int', 255),   # G-PDU
+        ('length', 2, 'int', None),
+        ('teid', 4, 'int', 0),
+    ]
+
+    def post_build(self, hdr, offsets, pay, underlayer):
+        self.set_computed(hdr, offsets, 'length', len(pay))
+
+
+class Raw(Layer):
+    fields_desc = [('load', 0, 'raw', b'')]
+
+    def __init__(self, load=b''):
+        if isinstance(load, str):
+            load = load.encode('latin-1')
+        super(Raw, self).__init__(load=load)
+
+
+def get_field_layout():
+    "(layer name, field name) -> (offset within the layer, size, encoding)"
+    layout = {}
+    for cls in [Ether, IP, UDP, TCP, VXLAN, GTPHeader]:
+        offset = 0
+        for name, size, enc, _ in cls.fields_desc:
+            layout[cls.__name__, name] = (offset, size, enc)
+            offset += size
+    return layout
+
+FIELD_LAYOUT = get_field_layout()
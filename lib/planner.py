@@ -0,0 +1,94 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Order the measurements to minimize the reconfiguration of the SUT.
+
+Between two consecutive measurements, the SUT has to be
+- set up from scratch, if the SUT settings (type, ports, etc.) differ,
+- restarted with a new pipeline, if the pipeline settings differ,
+- restarted with the same pipeline, if only the number of cores
+  differs,
+- nothing, if only the traffic or the Tester settings differ: the
+  running SUT can be reused (see lib/run_measurement.py).
+
+The costs are nested: measurements sharing the pipeline share the SUT
+settings too.  So the order with the minimal total cost groups the
+measurements by the SUT settings, then by the pipeline settings but the
+number of cores, then by the number of cores.  The groups keep the
+order of their first measurement, so does the order within the groups.
+"""
+
+import json
+
+__all__ = ['TRANSITION_COSTS', 'transition', 'transitions', 'setup_cost',
+           'plan_order']
+
+# Estimated cost of the transitions [s]
+TRANSITION_COSTS = {
+    'sut': 60,
+    'pipeline': 20,
+    'core': 15,
+    'traffic': 0,
+}
+
+def section(conf, name, ignored_keys=()):
+    "Canonical form of section `name` of a benchmark config"
+    data = dict(conf.get(name) or {})
+    for key in ignored_keys:
+        data.pop(key, None)
+    return json.dumps(data, sort_keys=True)
+
+def levels(conf):
+    "The keys of the SUT, pipeline and core settings of `conf`"
+    return (section(conf, 'sut'),
+            section(conf, 'pipeline', ['core']),
+            json.dumps((conf.get('pipeline') or {}).get('core')))
+
+def transition(prev, conf):
+    """Type of the transition from benchmark config `prev` to `conf`,
+    see TRANSITION_COSTS.  `prev` is None before the first
+    measurement."""
+    if prev is None:
+        return 'sut'
+    for kind, a, b in zip(['sut', 'pipeline', 'core'],
+                          levels(prev), levels(conf)):
+        if a != b:
+            return kind
+    return 'traffic'
+
+def transitions(configs):
+    "Types of the transitions before each of `configs`"
+    return [transition(prev, conf)
+            for prev, conf in zip([None] + configs[:-1], configs)]
+
+def setup_cost(configs, costs=TRANSITION_COSTS):
+    "Estimated total setup cost of running `configs` in the given order"
+    return sum(costs[t] for t in transitions(configs))
+
+def plan_order(configs):
+    "Return `configs` in the order with the minimal setup cost"
+    first = {}
+    def key(i):
+        # Index of the first config in the group of each level
+        ret = []
+        conf_levels = levels(configs[i])
+        for depth in range(1, len(conf_levels) + 1):
+            ret.append(first.setdefault(conf_levels[:depth], i))
+        return ret + [i]
+    keys = [key(i) for i in range(len(configs))]
+    return [configs[i] for i in sorted(range(len(configs)),
+                                       key=lambda i: keys[i])]
@@ -17,8 +17,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import argparse
+import hashlib
 import json
 import subprocess
+import sys
 from pathlib import Path, PosixPath
 
 import find_mod
@@ -58,24 +61,121 @@ class Config(dict):
         self.update(**data)
 
 
-def run(defaults=None):
+def sut_key(conf, conf_dir):
+    """Hash of the SUT and pipeline settings of a measurement.  A running
+    SUT can be reused by the measurements with the same key."""
+    h = hashlib.sha256()
+    for name in ('sut', 'pipeline'):
+        h.update(json.dumps(conf.get(name), sort_keys=True).encode())
+    for fname in ('pipeline.json', 'pipeline.json.tables.npz'):
+        fname = conf_dir / fname
+        h.update(fname.read_bytes() if fname.exists() else b'')
+        h.update(b'\0')
+    return h.hexdigest()
+
+def load_sut_state(state_file):
+    "Return the state of the running SUT saved by run(), None if unknown"
+    try:
+        with state_file.open() as f:
+            return json.load(f, object_hook=lambda x: Config(**x))
+    except (OSError, ValueError):
+        return None
+
+def stop_sut(state_file):
+    "Stop the SUT left running by run() according to `state_file`"
+    state = load_sut_state(state_file)
+    if state is None:
+        return
+    conf = state.benchmark
+    sut = find_mod.new('SUT', conf.sut.type, conf)
+    if sut.is_running():
+        sut.stop()
+    state_file.unlink()
+
+def sut_scripts(conf):
+    "The setup and teardown scripts of the SUT run by SUT.start/stop()"
+    scripts = [conf.sut.get('setup-script'), conf.sut.get('teardown-script')]
+    return [s for s in scripts if s and Path(s).is_file()]
+
+def start_sut(sut, conf, cwd, state_file):
+    """Start the SUT, or reuse the SUT left running by the previous
+    measurement (see run()) if it has the same SUT and pipeline
+    settings.  A reused SUT only resets its counters and run-time
+    tasks (warm-SUT mode), SUTs not supporting this are restarted.
+    Return True if the SUT has been reused."""
+    if state_file:
+        state = load_sut_state(state_file)
+        if (state and state.key == sut_key(conf, cwd) and
+            sut.is_running() and sut.reset()):
+            sut.result.update(state.result)
+            return True
+        stop_sut(state_file)
+    sut.start()
+    return False
+
+def run(defaults=None, sut_state=None):
+    """Run the measurement in the current directory.  If `sut_state` (a
+    Path) is given, the SUT is left running after the measurement, and
+    its state is saved to `sut_state`, so that the next measurement can
+    reuse it if only the traffic or the Tester settings differ (see
+    start_sut()).  The SUT has to be stopped with stop_sut() in the
+    end.  SUTs with setup or teardown scripts are never reused, as the
+    scripts are run only when the SUT starts and stops."""
     cwd = Path().cwd()
     conf = Config(cwd / 'benchmark.json')
+    if sut_state and sut_scripts(conf):
+        # A reused SUT would skip the scripts of the measurement
+        print('warning: the SUT has setup/teardown scripts (%s), '
+              'restarting it instead of reusing it' %
+              ', '.join(sut_scripts(conf)), file=sys.stderr)
+        stop_sut(sut_state)
+        sut_state = None
     sut = find_mod.new('SUT', conf.sut.type, conf)
-    sut.start()
+    reused = start_sut(sut, conf, cwd, sut_state)
+    start_result = dict(sut.result)
 
     tester_type = conf.tester.type.replace('-','_')
     tester = find_mod.new('Tester', tester_type, conf)
-    tester.run(cwd)
-
-    sut.stop()
+    try:
+        tester.run(cwd)
+    except:
+        if sut_state and sut_state.exists():
+            sut_state.unlink()
+        sut.stop()
+        raise
+
+    if sut_state:
+        sut.query_result()
+        with sut_state.open('w') as f:
+            json.dump({'key': sut_key(conf, cwd), 'benchmark': conf,
+                       'result': start_result}, f, sort_keys=True, indent=4)
+    else:
+        sut.stop()
 
     result = conf
     result['out'] = {'sut': sut.result}
+    result['out']['sut']['reused'] = reused
     result['out'].update(tester.result)
+    stats = cwd / 'traffic.pcap.stats.json'
+    if stats.exists():
+        with stats.open() as f:
+            result['out']['traffic'] = json.load(f)
     with open('results.json', 'w') as f:
         json.dump(result, f, sort_keys=True, indent=4)
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(
+        description='Run the measurement in the current directory')
+    parser.add_argument('--sut-state', type=Path,
+                        help='Keep the SUT running after the measurement '
+                        'and save its state to this file, reuse the SUT '
+                        'saved here if only the traffic differs')
+    parser.add_argument('--stop-sut', action='store_true',
+                        help='Only stop the SUT saved in --sut-state')
+    args = parser.parse_args()
+    if args.stop_sut:
+        if args.sut_state:
+            stop_sut(args.sut_state)
+    else:
+        run(sut_state=args.sut_state)
@@ -0,0 +1,194 @@
+# TIPSY: Telco pIPeline benchmarking SYstem
+#
+# Copyright (C) 2018 by its authors (See AUTHORS)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Run a DAG of tasks on a worker pool and on a serial lane.
+
+The tasks of the 'pool' lane (e.g., generating pipeline configs and
+traffic traces) run concurrently on a limited number of workers, the
+tasks of the 'serial' lane (the measurements sharing the testbed) run
+one by one.  Among the ready tasks of a lane, the one with the lowest
+priority value starts first, so the generators work for the next
+measurement instead of running far ahead of it.
+
+The scheduler records the duration of every task and the time the
+serial lane was idle waiting for its next task to become ready.
+"""
+
+import concurrent.futures
+import heapq
+import time
+
+__all__ = ['Task', 'Scheduler', 'format_duration']
+
+def format_duration(seconds):
+    "3725.2 -> '1:02:05'"
+    if seconds is None:
+        return 'n/a'
+    seconds = int(round(seconds))
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Task(object):
+    """A node of the DAG: `func()` is run once all of `deps` succeeded.
+    A task fails if `func` raises an exception or returns False."""
+
+    def __init__(self, name, stage, func, deps=(), lane='pool', priority=0):
+        self.name = name
+        self.stage = stage
+        self.func = func
+        self.deps = list(deps)
+        self.lane = lane
+        self.priority = priority
+        self.state = 'waiting'  # ready, running, done, failed, skipped
+        self.error = None
+        self.start = None
+        self.duration = None
+        self.dependents = []
+        self.waiting_for = 0
+
+    def __repr__(self):
+        return '<Task %s/%s: %s>' % (self.name, self.stage, self.state)
+
+    def __lt__(self, other):
+        return self.priority < other.priority
+
+
+class Scheduler(object):
+    def __init__(self, jobs, keep_going=False, report=None):
+        """`jobs` is the number of the pool workers.  Unless `keep_going`
+        is set, no new task is started after a failure.  `report(task)`
+        is called in the main thread when a task finished (or has been
+        skipped)."""
+        self.jobs = max(1, jobs)
+        self.keep_going = keep_going
+        self.report = report or (lambda task: None)
+        self.tasks = []
+        self.serial_idle = 0.0
+
+    def add(self, *args, **kw):
+        "Create a new task (see Task), return it"
+        task = Task(*args, **kw)
+        for dep in task.deps:
+            dep.dependents.append(task)
+        self.tasks.append(task)
+        return task
+
+    def remaining(self, lane=None):
+        "Number of the unfinished tasks (of `lane`)"
+        return sum(1 for t in self.tasks
+                   if t.state in ('waiting', 'ready', 'running') and
+                   lane in (None, t.lane))
+
+    def stage_stats(self):
+        """Return the (stage, count, total, max) durations of the
+        completed tasks, in the order of the first appearance of the
+        stages"""
+        stats = {}
+        for task in self.tasks:
+            if task.duration is None:
+                continue
+            count, total, longest = stats.get(task.stage, (0, 0.0, 0.0))
+            stats[task.stage] = (count + 1, total + task.duration,
+                                 max(longest, task.duration))
+        order = []
+        for task in self.tasks:
+            if task.stage in stats and task.stage not in order:
+                order.append(task.stage)
+        return [(stage,) + stats[stage] for stage in order]
+
+    def _run_task(self, task):
+        task.start = time.time()
+        try:
+            ok = task.func() is not False
+        except Exception as e:
+            task.error = e
+            ok = False
+        task.duration = time.time() - task.start
+        return ok
+
+    def _finish(self, task, ok, ready):
+        task.state = 'done' if ok else 'failed'
+        self.report(task)
+        for dep in task.dependents:
+            if not ok:
+                self._skip(dep)
+                continue
+            dep.waiting_for -= 1
+            if dep.waiting_for == 0 and dep.state == 'waiting':
+                dep.state = 'ready'
+                heapq.heappush(ready[dep.lane], dep)
+
+    def _skip(self, task):
+        if task.state not in ('waiting', 'ready'):
+            return
+        task.state = 'skipped'
+        self.report(task)
+        for dep in task.dependents:
+            self._skip(dep)
+
+    def run(self):
+        "Run the tasks, return True if all of them succeeded"
+        ready = {'pool': [], 'serial': []}
+        for task in self.tasks:
+            task.waiting_for = len(task.deps)
+            if task.waiting_for == 0:
+                task.state = 'ready'
+                heapq.heappush(ready[task.lane], task)
+
+        running = {}
+        failed = False
+        idle_since = time.time()
+        pool = concurrent.futures.ThreadPoolExecutor(self.jobs)
+        serial = concurrent.futures.ThreadPoolExecutor(1)
+        try:
+            while True:
+                if not failed or self.keep_going:
+                    pool_running = sum(1 for t in running.values()
+                                       if t.lane == 'pool')
+                    while ready['pool'] and pool_running < self.jobs:
+                        task = heapq.heappop(ready['pool'])
+                        task.state = 'running'
+                        running[pool.submit(self._run_task, task)] = task
+                        pool_running += 1
+                    serial_busy = any(t.lane == 'serial'
+                                      for t in running.values())
+                    if ready['serial'] and not serial_busy:
+                        task = heapq.heappop(ready['serial'])
+                        task.state = 'running'
+                        running[serial.submit(self._run_task, task)] = task
+                        self.serial_idle += time.time() - idle_since
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    ok = future.result()
+                    if task.lane == 'serial':
+                        idle_since = time.time()
+                    self._finish(task, ok, ready)
+                    failed = failed or not ok
+        finally:
+            # Executor.shutdown() has no cancel_futures before python 3.9
+            for future in running:
+                future.cancel()
+            pool.shutdown(wait=True)
+            serial.shutdown(wait=True)
+        for task in self.tasks:
+            if task.state in ('waiting', 'ready'):
+                self._skip(task)
+        return not failed
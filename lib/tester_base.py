@@ -15,11 +15,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import contextlib
 import datetime
+import os
+import shutil
+import struct
 import subprocess
+import tempfile
 import time
 from pathlib import Path
 
+try:
+    import pcap_compress
+except ImportError:
+    from . import pcap_compress
+
+# Traffic files of the measurement directory: the outputs of gen_pcap
+# and the uplink half of a split tagged bidir trace.  Their temporary
+# versions (see raw_fname()) are removed after the measurement.
+PCAP_FILES = ['traffic.pcap', 'traffic.downlink.pcap', 'traffic.uplink.pcap',
+              'traffic.pcap.dir']
+
 class Tester(object):
     def __init__(self, conf):
         self.conf = conf
@@ -39,7 +55,11 @@ class Tester(object):
         self.result['iso-date'] =  datetime.datetime.now().isoformat()
         self.result['test-id'] = out_dir.name
         self.run_setup_script()
-        self._run(out_dir)
+        with self.traffic_pcaps(out_dir):
+            try:
+                self._run(out_dir)
+            finally:
+                remove_files(raw_fname(out_dir / f) for f in PCAP_FILES)
         self.run_teardown_script()
         self.collect_results()
 
@@ -49,6 +69,83 @@ class Tester(object):
     def collect_results(self):
         raise NotImplementedError
 
+    def get_pcaps(self, out_dir):
+        """Return the (uplink, downlink) pcap files of the measurement.
+
+        Only one of them is set, unless traffic.dir is bidir.  Tagged
+        bidir traces (traffic.pcap with traffic.pcap.dir) are split here
+        into temporary files, like the decompressed pcaps (see
+        uncompressed()).
+        """
+        pcap = out_dir / 'traffic.pcap'
+        if self.conf.traffic.dir == 'uplink':
+            return self.uncompressed(pcap), None
+        if self.conf.traffic.dir == 'downlink':
+            return None, self.uncompressed(pcap)
+        dir_file = out_dir / 'traffic.pcap.dir'
+        if not dir_file.is_file():
+            return (self.uncompressed(pcap),
+                    self.uncompressed(out_dir / 'traffic.downlink.pcap'))
+        uplink = raw_fname(out_dir / 'traffic.uplink.pcap')
+        downlink = raw_fname(out_dir / 'traffic.downlink.pcap')
+        if not (uplink.exists() and downlink.exists()):
+            # Not split yet, e.g., by the other half of moongen-combined
+            split_tagged_pcap(pcap, dir_file, uplink, downlink)
+        return uplink, downlink
+
+    @contextlib.contextmanager
+    def traffic_pcaps(self, out_dir):
+        """Provide the pcap files of the measurement while the tester runs.
+
+        With the default tester.pcap-storage (disk), make has already
+        generated them.  With 'shm', gen_pcap is run here writing the
+        pcaps to /dev/shm (symlinked into `out_dir`), and they are
+        removed after the measurement.  Without /dev/shm, the pcaps are
+        generated into `out_dir` instead, but they are removed as well.
+        """
+        storage = self.conf.tester.get('pcap-storage', 'disk')
+        if storage == 'disk':
+            yield
+            return
+        use_shm = os.path.isdir('/dev/shm')
+        if not use_shm:
+            print('pcap-storage: /dev/shm is not available, generating the '
+                  'trace into %s (removed after the measurement)' % out_dir)
+
+        files = [out_dir / f for f in PCAP_FILES]
+        cmd = [str(Path(__file__).parent / 'gen_pcap.py'),
+               '--json', 'traffic.json', '--conf', 'pipeline.json',
+               '--output', str(out_dir / 'traffic.pcap')]
+        shm_dir = None
+        remove_files(files)
+        try:
+            if use_shm:
+                shm_dir = tempfile.mkdtemp(prefix='tipsy-', dir='/dev/shm')
+                for f in files:
+                    f.symlink_to(Path(shm_dir, f.name))
+            subprocess.run(cmd, cwd=str(out_dir), check=True)
+            yield
+        finally:
+            remove_files(files)
+            if shm_dir:
+                shutil.rmtree(shm_dir, ignore_errors=True)
+
+    def uncompressed(self, pcap):
+        """Return the uncompressed version of `pcap`.
+
+        A compressed pcap is decompressed next to the original file (to
+        <pcap>.raw, removed after the measurement).
+        """
+        if not pcap_compress.detect(pcap):
+            return pcap
+        raw = raw_fname(pcap)
+        if os.path.lexists(str(raw)):
+            # Already decompressed, e.g., by the other half of
+            # moongen-combined
+            return raw
+        pcap_compress.decompress_file(pcap, raw)
+        return raw
+
     def run_script(self, script):
         if Path(script).is_file():
             subprocess.run([str(script)], check=True)
@@ -60,3 +157,40 @@ class Tester(object):
         self.run_script(self.conf.tester.teardown_script)
 
 
+def remove_files(files):
+    for f in files:
+        if os.path.lexists(str(f)):
+            os.unlink(str(f))
+
+def raw_fname(pcap):
+    """Temporary (decompressed or split) version of `pcap`, beside the
+    target of a symlink"""
+    real = Path(os.path.realpath(str(pcap)))
+    return real.with_name(real.name + '.raw')
+
+def split_tagged_pcap(pcap, dir_file, uplink, downlink):
+    """Split a tagged bidir pcap into an uplink and a downlink pcap.
+
+    dir_file contains one byte ('u' or 'd') for each packet of pcap.
+    """
+    with open(str(dir_file), 'rb') as f:
+        tags = f.read()
+    with pcap_compress.open_pcap(pcap) as inp, \
+         open(str(uplink), 'wb') as up, \
+         open(str(downlink), 'wb') as down:
+        header = inp.read(24)
+        if header[:4] in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            rec_hdr = struct.Struct('<IIII')
+        else:
+            rec_hdr = struct.Struct('>IIII')
+        up.write(header)
+        down.write(header)
+        for tag in tags:
+            hdr = inp.read(rec_hdr.size)
+            if len(hdr) < rec_hdr.size:
+                raise Exception('%s: less packets than tags in %s' %
+                                (pcap, dir_file))
+            caplen = rec_hdr.unpack(hdr)[2]
+            out = up if tag == ord('u') else down
+            out.write(hdr)
+            out.write(inp.read(caplen))
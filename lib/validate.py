@@ -52,7 +52,28 @@ from . import find_mod
 schema_dir = path.join(path.abspath(path.dirname(__file__)),
                        '..', 'schema')
 
+# Process-wide caches: the validators of the named schemas keyed by
+# (schema_name, extension), the validator classes keyed by extension
+# and the discriminators of the 'oneOf' keywords keyed by id(oneOf).
+validators = {}
+validator_classes = {}
+oneOf_discriminators = {}
+
 class ResolverWithPlugins(jsonschema.RefResolver):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.resolved = {}
+
+  def resolve(self, ref):
+    # The schemas do not change, so a reference always resolves to the
+    # same subschema in the same scope
+    key = (self.resolution_scope, ref)
+    try:
+      return self.resolved[key]
+    except KeyError:
+      ret = self.resolved[key] = super().resolve(ref)
+      return ret
+
   def resolve_remote(self, uri):
     #print('resolve_remote: %s' % uri)
     m = re.search(r'^file:\/\/.*\/schema\/(.*)$', uri)
@@ -69,10 +90,56 @@ class ResolverWithPlugins(jsonschema.RefResolver):
 # Background info:
 # https://spacetelescope.github.io/understanding-json-schema/index.html
 
+def oneOf_discriminator (validator, oneOf):
+  """Return (property, {value: index}) if every subschema of `oneOf`
+  allows a single, distinct value of its 'name' or 'type' property.
+  Otherwise, return None."""
+  try:
+    cached_oneOf, discriminator = oneOf_discriminators[id(oneOf)]
+    if cached_oneOf is oneOf:
+      return discriminator
+  except KeyError:
+    pass
+  subschemas = []
+  for subschema in oneOf:
+    if '$ref' in subschema:
+      _, subschema = validator.resolver.resolve(subschema['$ref'])
+    subschemas.append(subschema)
+  discriminator = None
+  for prop in ('name', 'type'):
+    indices = {}
+    for index, subschema in enumerate(subschemas):
+      enum = subschema.get('properties', {}).get(prop, {}).get('enum')
+      if not enum or len(enum) != 1 or enum[0] in indices:
+        break
+      indices[enum[0]] = index
+    else:
+      discriminator = (prop, indices)
+      break
+  oneOf_discriminators[id(oneOf)] = (oneOf, discriminator)
+  return discriminator
+
 # This is a modification of jsonschema._validators.oneOf_draft4()
 #
 # It resets the defaults after backtracking
 def oneOf_with_default (validator, oneOf, instance, schema):
+  # Fast path: if the subschemas are told apart by their 'name' or
+  # 'type' property, only one of them can be valid.
+  discriminator = oneOf_discriminator(validator, oneOf)
+  if discriminator and isinstance(instance, dict):
+    prop, indices = discriminator
+    value = instance.get(prop)
+    if isinstance(value, str) and value in indices:
+      index = indices[value]
+      errs = list(validator.descend(instance, oneOf[index],
+                                    schema_path=index))
+      if errs:
+        yield jsonschema.ValidationError(
+          "%r is not valid under any of the given schemas" % (instance,),
+          context=errs,
+        )
+      return
+
   subschemas = enumerate(oneOf)
   all_errors = []
   for index, subschema in subschemas:
@@ -105,13 +172,15 @@ def extend_with_default (validator_class):
 
   def set_defaults(validator, properties, instance, schema):
     for property, subschema in properties.items():
-      if "default" in subschema:
-        instance.setdefault(property, subschema["default"])
+      if "default" in subschema and property not in instance:
+        # The schema is cached, the instances must not share its objects
+        instance[property] = deepcopy(subschema["default"])
 
-      for error in validate_properties(
-          validator, properties, instance, schema,
-      ):
-        yield error
+    # Validate the properties once, after setting all of the defaults
+    for error in validate_properties(
+        validator, properties, instance, schema,
+    ):
+      yield error
 
   return jsonschema.validators.extend(
     validator_class, {"properties" : set_defaults,
@@ -140,24 +209,45 @@ def extend_with_property_array (validator_class):
   return jsonschema.validators.extend(
     validator_class, {"properties": allow_property_array})
 
-def validate_data (data, schema=None, schema_name=None, extension='default'):
+def load_schema (schema_name):
+  fname = path.join(schema_dir, schema_name + '.json')
+  if not path.exists(fname):
+    fname = find_mod.find_file(schema_name + '.json')
+    if not fname:
+      raise Exception('Cannot file schema file for %s' % schema_name)
+  with open(fname) as f:
+    return json.load(f)
+
+def get_validator_class (extension):
+  if extension not in validator_classes:
+    if extension is not None:
+      fn = globals()['extend_with_%s' % extension]
+      validator_classes[extension] = fn(jsonschema.Draft4Validator)
+    else:
+      validator_classes[extension] = jsonschema.Draft4Validator
+  return validator_classes[extension]
+
+def get_validator (schema=None, schema_name=None, extension='default'):
+  """Return a validator of `schema`, or of the schema called
+  `schema_name`.  The validators of the named schemas are cached
+  together with their loaded schemas and resolved references.  (The
+  extensions might modify the schemas, so a validator is not shared
+  among the extensions.)"""
+  key = (schema_name, extension)
+  if schema_name and key in validators:
+    return validators[key]
   if schema_name:
-    fname = path.join(schema_dir, schema_name + '.json')
-    if not path.exists(fname):
-      fname = find_mod.find_file(schema_name + '.json')
-      if not fname:
-        raise Exception('Cannot file schema file for %s' % schema_name)
-    with open(fname) as f:
-      schema = json.load(f)
-
-  if extension is not None:
-    fn = globals()['extend_with_%s' % extension]
-    validator = fn(jsonschema.Draft4Validator)
-  else:
-    validator = jsonschema.Draft4Validator
+    schema = load_schema(schema_name)
   resolver = ResolverWithPlugins('file://' + schema_dir + '/', schema)
+  validator = get_validator_class(extension)(schema, resolver=resolver)
+  if schema_name:
+    validators[key] = validator
+  return validator
+
+def validate_data (data, schema=None, schema_name=None, extension='default'):
+  validator = get_validator(schema, schema_name, extension)
   try:
-    validator(schema, resolver=resolver).validate(data)
+    validator.validate(data)
   except jsonschema.exceptions.ValidationError as e:
     # The default exception is not very helpful in case of the 'oneOf'
     # keyword: "... is not vaild under any of the given schemas".
@@ -25,36 +25,86 @@ class GenConf (Base):
     super().__init__(args)
     self.components += ['fakedrop', 'service']
 
-  def get_prefix_tree (self, new_elements, tree=None):
-    import random
-    from socket import inet_ntoa, inet_aton
-    from struct import pack, unpack
-
-    if new_elements == 0:
-      return tree
-
-    if tree is None:
-      tree = [('0.0.0.0', 0)]
-      return self.get_prefix_tree(new_elements - 1, tree)
+  def get_prefix_tree (self, leaf_num):
+    """Split the IPv4 address space into `leaf_num` prefixes.
 
-    ok = False
-    while not ok:
-      subtree = random.choice(tree)
-      prefix, prefix_len = subtree
-      ok = prefix_len < 24
-    idx = tree.index(subtree)
-    del tree[idx]
+    The prefixes are the leaves of a binary tree grown from 0.0.0.0/0
+    by splitting one leaf at a time, at most to /max_prefix_len.  The
+    leaf to split is selected according to `prefix_split`:
+      uniform:       a random splittable leaf
+      size-weighted: a random splittable leaf with a probability
+                     proportional to its address space
+      balanced:      the shortest leaf, so the prefix lengths differ by
+                     at most one
+    Return (prefix, prefix_len) tuples in address order.
+    """
+    import collections
+    import itertools
+    import random
+    from socket import inet_ntoa
+    from struct import pack
 
-    # split subtree
-    prefix_len += 1
-    prefix_b = unpack('!I', inet_aton(prefix))[0]
-    prefix_2 = prefix_b | (1 << (32 - prefix_len))
-    prefix_2 = pack('!I', prefix_2)
-    # add new subtrees
-    tree += [(prefix, prefix_len), (inet_ntoa(prefix_2), prefix_len)]
+    max_len = self.args.max_prefix_len
+    if leaf_num > 2 ** max_len:
+      raise ValueError('%d backends do not fit into /%d prefixes' %
+                       (leaf_num, max_len))
+    if leaf_num == 0:
+      return []
 
-    return self.get_prefix_tree(new_elements -1, tree)
+    split = self.args.prefix_split
+    done = []                   # leaves of length max_len
+    if split == 'uniform':
+      leaves = [(0, 0)]
+      for _ in range(leaf_num - 1):
+        idx = random.randrange(len(leaves))
+        prefix, prefix_len = leaves[idx]
+        prefix_len += 1
+        right = (prefix | 1 << (32 - prefix_len), prefix_len)
+        if prefix_len < max_len:
+          leaves[idx] = (prefix, prefix_len)
+          leaves.append(right)
+        else:
+          done += [(prefix, prefix_len), right]
+          last = leaves.pop()
+          if idx < len(leaves):
+            leaves[idx] = last
+    elif split == 'balanced':
+      leaves = collections.deque([(0, 0)])
+      for _ in range(leaf_num - 1):
+        prefix, prefix_len = leaves.popleft()
+        prefix_len += 1
+        children = [(prefix, prefix_len),
+                    (prefix | 1 << (32 - prefix_len), prefix_len)]
+        if prefix_len < max_len:
+          leaves.extend(children)
+        else:
+          done += children
+    elif split == 'size-weighted':
+      # Prefixes of the splittable leaves by prefix length
+      buckets = [[] for _ in range(max_len)]
+      buckets[0].append(0)
+      lengths = range(max_len)
+      for _ in range(leaf_num - 1):
+        weights = [len(b) << (max_len - l) for l, b in enumerate(buckets)]
+        cum_weights = list(itertools.accumulate(weights))
+        prefix_len = random.choices(lengths, cum_weights=cum_weights)[0]
+        bucket = buckets[prefix_len]
+        idx = random.randrange(len(bucket))
+        prefix = bucket[idx]
+        bucket[idx] = bucket[-1]
+        bucket.pop()
+        prefix_len += 1
+        children = [prefix, prefix | 1 << (32 - prefix_len)]
+        if prefix_len < max_len:
+          buckets[prefix_len] += children
+        else:
+          done += [(c, prefix_len) for c in children]
+      leaves = [(p, l) for l, b in enumerate(buckets) for p in b]
+    else:
+      raise ValueError('unknown prefix split: %s' % split)
 
+    return [(inet_ntoa(pack('!I', prefix)), prefix_len)
+            for prefix, prefix_len in sorted(itertools.chain(leaves, done))]
 
   def add_service (self):
     from socket import inet_ntoa
@@ -84,5 +134,5 @@ class GenConf (Base):
                   'args': {
                     's_idx': idx % self.args.service_num
                   }}
-      self.conf['run_time'].append(mod_port)
+      self.run_time.append(mod_port)
 
@@ -15,12 +15,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import random
-from scapy.all import *
+import numpy as np
+from pkt_hdr import *
 
+from conf_tables import ip2int
 from gen_pcap_base import GenPkt as Base
+from gen_pcap_base import table2array
 
 class GenPkt(Base):
+    use_template = True
+
+    def __init__(self, *args, **kw):
+        super(GenPkt, self).__init__(*args, **kw)
+        backends = len(self.conf.service[0].backend)
+        self.backend_ip = np.array(
+            [table2array(s.backend[:backends], 'ip_src', ip2int)
+             for s in self.conf.service], dtype=np.uint64)
+        self.service_ip = table2array(self.conf.service, 'ip_dst', ip2int)
+        self.service_port = table2array(self.conf.service, 'udp_dst', int)
+        self.backend_prefix_len = np.array(
+            [table2array(s.backend[:backends], 'prefix_len')
+             for s in self.conf.service], dtype=np.uint64)
 
     def get_auto_pkt_num(self):
         services = len(self.conf.service)
@@ -28,28 +43,30 @@ class GenPkt(Base):
         # 10 pkts for each backend
         return 10 * services * backends
 
-    def gen_pkt(self, pkt_idx):
-        services = len(self.conf.service)
-        backends = len(self.conf.service[0].backend)
-
-        service_idx = (pkt_idx // backends) % services
-        backend_idx = pkt_idx % backends
-        service = self.conf.service[service_idx]
-        backend = service.backend[backend_idx]
-
-        if backend.prefix_len > 24:
-            raise Exception('prefix (%d) > 24' % backend.prefix_len)
-        ip_src = backend.ip_src.split('.')
-        ip_src[-1] = str(random.randint(1, 254))
-        ip_src = '.'.join(ip_src)
-        udp_src = 22 + (pkt_idx % 1000)
-
+    def gen_template(self, key):
         pkt = (
             Ether(dst=self.conf.gw.mac) /
-            IP(src=ip_src, dst=service.ip_dst) /
-            UDP(sport=udp_src, dport=int(service.udp_dst))
+            IP() /
+            UDP()
         )
+        return pkt, {'sip': 'IP.src', 'dip': 'IP.dst',
+                     'sport': 'UDP.sport', 'dport': 'UDP.dport'}
+
+    def gen_fields_batch(self, pkt_idxs):
+        services, backends = self.backend_ip.shape
+        pkt_idxs = np.asarray(pkt_idxs)
+        n = len(pkt_idxs)
 
-        pkt = self.add_payload(pkt, self.args.pkt_size)
-        return pkt
+        service_idx = (pkt_idxs // backends) % services
+        backend_idx = pkt_idxs % backends
+        prefix_len = self.backend_prefix_len[service_idx, backend_idx].max()
+        if prefix_len > 24:
+            raise Exception('prefix (%d) > 24' % prefix_len)
+        ip_src = self.backend_ip[service_idx, backend_idx]
+        host = self.rng.randint(1, 255, size=n).astype(np.uint64)
+        ip_src = (ip_src & ~np.uint64(0xff)) | host
+        udp_src = 22 + (pkt_idxs % 1000)
+        return [(None, slice(None), n,
+                 {'sip': ip_src, 'dip': self.service_ip[service_idx],
+                  'sport': udp_src, 'dport': self.service_port[service_idx]})]
 
@@ -25,7 +25,7 @@ class Tester(Base):
     def __init__(self, conf):
         super().__init__(conf)
         tester = conf.tester
-        if conf.traffic.dir == 'uplink':
+        if conf.traffic.dir in ['uplink', 'bidir']:
             self.txdev = tester.uplink_port
             self.rxdev = tester.downlink_port
         elif conf.traffic.dir == 'downlink':
@@ -43,11 +43,14 @@ class Tester(Base):
         self.loss_tolerance = tester.loss_tolerance
 
     def _run(self, out_dir):
-        pcap = out_dir / 'traffic.pcap'
+        uplink, downlink = self.get_pcaps(out_dir)
+        pcap = uplink or downlink
         pfix = out_dir / 'mg'
         hfile = out_dir / 'mg.histogram.csv'
         cmd = ['sudo', self.mg_cmd, self.script, self.txdev, self.rxdev, pcap,
                '-l', '-t', '-r', self.runtime, '-o', pfix, '--hfile', hfile]
+        if uplink and downlink:
+            cmd += ['--reverse-file', downlink]
         if self.rate_limit:
             cmd += ['--rate-limit', self.rate_limit]
         cmd = [ str(o) for o in cmd ]
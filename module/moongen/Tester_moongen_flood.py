@@ -26,10 +26,13 @@ class Tester(Base):
         self.script = self.lua_dir / 'mg-flood.lua'
 
     def _run(self, out_dir):
-        pcap = out_dir / 'traffic.pcap'
+        uplink, downlink = self.get_pcaps(out_dir)
+        pcap = uplink or downlink
         ofile = out_dir / 'mg.flood.csv'
         cmd = ['sudo', self.mg_cmd, self.script, self.txdev, self.rxdev,
                pcap, '-l', '-r', self.runtime, '-o', ofile]
+        if uplink and downlink:
+            cmd += ['--reverse-file', downlink]
         cmd = [ str(o) for o in cmd ]
         print(' '.join(cmd))
         subprocess.call(cmd)
@@ -23,6 +23,8 @@ from Tester_moongen import Tester as Base
 class Tester(Base):
     def __init__(self, conf):
         super().__init__(conf)
+        if conf.traffic.dir == 'bidir':
+            raise Exception("unavailable traffic.dir: %s" % conf.traffic.dir)
         self.script = self.lua_dir / 'mg-rfc2544.lua'
 
     def _run(self, out_dir):
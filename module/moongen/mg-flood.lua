@@ -36,6 +36,10 @@ function configure(parser)
       :convert(tonumber)
    parser:argument("file", "pcap file")
       :args(1)
+   parser:option("--reverse-file", "pcap file replayed from rxDev to txDev\n"
+                 .. "at the same time (bidirectional traffic)")
+      :default(nil)
+      :target("reverseFile")
    parser:option("-r --runtime", "running time in seconds.")
       :default(0)
       :convert(tonumber)
@@ -51,6 +55,8 @@ function master(args)
    if args.txDev ~= args.rxDev then
      txDev = device.config({port = args.txDev, txQueues = 1, rxQueues = 1})
      rxDev = device.config({port = args.rxDev, rxQueues = 1, txQueues = 1})
+   elseif args.reverseFile then
+      log:fatal("--reverse-file requires different txDev and rxDev")
    else
       txDev = device.config({port = args.txDev, txQueues = 1, rxQueues = 1})
       rxDev = txDev
@@ -58,11 +64,17 @@ function master(args)
    device.waitForLinks()
    mg.startTask("replay_pcap", txDev:getTxQueue(0), args.file, args.loop,
                 rxDev:getRxQueue(0))
+   local txDevs, rxDevs = {txDev}, {rxDev}
+   if args.reverseFile then
+      mg.startTask("replay_pcap", rxDev:getTxQueue(0), args.reverseFile,
+                   args.loop, txDev:getRxQueue(0))
+      txDevs, rxDevs = {txDev, rxDev}, {rxDev, txDev}
+   end
    if args.ofile then
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="csv", file=args.ofile}
    else
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="plain"}
    end
    if args.runtime > 0 then
@@ -56,6 +56,8 @@ function configure(parser)
    parser:argument("txDev", "txport[:numcores]"):default(0)
    parser:argument("rxDev", "rxport"):default(1):convert(tonumber)
    parser:argument("file", "pcap file"):args(1)
+   parser:option("--reverse-file", "pcap file replayed from rxDev to txDev\n"
+                 .. "at the same time (bidirectional traffic)"):default(nil):target("reverseFile")
    parser:option("--rate-limit", "replay speed [Mbit/s]\ndefault, 0: replay as fast as possible\n(Relies on hw rate limiting of txDev: see test-setRate.lua)"):default(0):convert(tonumber):target("rateLimit")
    parser:option("-h --hfile", "latency histogram."):default("histogram.csv")
    parser:option("-r --runtime", "running time in seconds."):default(0):convert(tonumber)
@@ -76,9 +78,13 @@ function master(args)
    end
    local txDev, rxDev, lastRxQue
    if txport ~= args.rxDev then
-     txDev = device.config({port = txport, txQueues = cores+1, rxQueues = 2})
-     rxDev = device.config({port = args.rxDev, rxQueues = cores+1, txQueues = 2})
+     local rxTxQueues = args.reverseFile and cores+1 or 2
+     local txRxQueues = args.reverseFile and cores+1 or 2
+     txDev = device.config({port = txport, txQueues = cores+1, rxQueues = txRxQueues})
+     rxDev = device.config({port = args.rxDev, rxQueues = cores+1, txQueues = rxTxQueues})
      lastRxQue = cores
+   elseif args.reverseFile then
+      log:fatal("--reverse-file requires different txDev and rxDev")
    else
       txDev = device.config({port = txport,
                              txQueues = cores+1, rxQueues = cores+1})
@@ -90,17 +96,27 @@ function master(args)
       mg.startTask("replay_pcap", txDev:getTxQueue(i-1),
                    args.file, args.loop)
    end
+   local txDevs, rxDevs = {txDev}, {rxDev}
+   if args.reverseFile then
+      for i = 1, cores do
+         mg.startTask("replay_pcap", rxDev:getTxQueue(i-1),
+                      args.reverseFile, args.loop)
+      end
+      txDevs, rxDevs = {txDev, rxDev}, {rxDev, txDev}
+   end
    if args.ofile then
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="csv", file=args.ofile .. ".throughput.csv"}
    else
-      stats.startStatsTask{txDevices = {txDev}, rxDevices = {rxDev},
+      stats.startStatsTask{txDevices = txDevs, rxDevices = rxDevs,
                            format="plain"}
    end
    if args.rateLimit > 0 then
       -- setting per que rate limit must come after startStatsTask
-      log:info('Set hw rate-limit of %s to %s Mbit/s', txDev, args.rateLimit)
-      setRate:setRate(txDev, args.rateLimit)
+      for _, dev in ipairs(txDevs) do
+         log:info('Set hw rate-limit of %s to %s Mbit/s', dev, args.rateLimit)
+         setRate:setRate(dev, args.rateLimit)
+      end
    end
    if args.timestamps then
       mg.startSharedTask("measure_latency", txDev:getTxQueue(cores),
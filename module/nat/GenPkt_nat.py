@@ -17,25 +17,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import random
-from scapy.all import *
+import numpy as np
+from pkt_hdr import *
 
 from gen_pcap_base import GenPkt as Base
-from gen_pcap_base import byte_seq
+from gen_pcap_base import byte_seq_int
 
 
 
 class GenPkt(Base):
+    use_template = True
 
     def get_auto_pkt_num(self):
         #return self.conf.num_flows
         return 10
 
-    def gen_pkt(self, pkt_idx):
+    def gen_template(self, key):
         smac = 'aa:bb:bb:aa:ab:ba'
         dmac = 'aa:cc:dd:cc:ac:dc'
-        sip = byte_seq('2.2.%d.%d', (pkt_idx % 64516) + 1)
-        dip = byte_seq('3.3.%d.%d', (pkt_idx % 64516) + 1)
-        p = Ether(dst=dmac, src=smac) / IP(src=sip, dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+        p = Ether(dst=dmac, src=smac) / IP()
+        return p, {'sip': 'IP.src', 'dip': 'IP.dst'}
+
+    def gen_fields_batch(self, pkt_idxs):
+        seq = (np.asarray(pkt_idxs) % 64516) + 1
+        sip = byte_seq_int(0x02020000, seq)
+        dip = byte_seq_int(0x03030000, seq)
+        return [(None, slice(None), len(pkt_idxs), {'sip': sip, 'dip': dip})]
@@ -44,6 +44,7 @@ from ryu.services.protocols.bgp.utils.evtlet import LoopingCall
 
 fdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(fdir, '..', '..', 'lib'))
+import conf_tables
 import find_mod
 
 CONF = cfg.CONF['tipsy']
@@ -78,7 +79,7 @@ class ObjectView(object):
     try:
       with open(fname, 'r') as f:
         conv_fn = lambda d: ObjectView(**d)
-        self.__dict__.update(json.load(f, object_hook=conv_fn).__dict__)
+        self.__dict__.update(conf_tables.load(f, object_hook=conv_fn).__dict__)
     except IOError as e:
       eprint('Failed to load cfg file (%s): %s' % (fname, e))
       raise e
@@ -465,6 +466,22 @@ class RyuApp(app_manager.RyuApp):
     # else:
     #   hub.spawn_after(1, TipsyController.do_exit)
 
+  def reset(self):
+    """Prepare the running pipeline for the next measurement (warm-SUT
+    mode): restart the run-time tasks and reset the counters"""
+    self.change_status('resetting')
+    self._timer.stop()
+    while self.lock:
+      hub.sleep(0.1)
+    self.reset_counters()
+    self.change_status('configured')
+    if self.pl_conf.get('run_time'):
+      self._timer.start(1)
+
+  def reset_counters(self):
+    "Reset the counters of the datapath (if it has any)"
+    pass
+
   def stop(self):
     self.change_status('stopping')
     self.stop_datapath()
@@ -511,6 +528,11 @@ class TipsyController(ControllerBase):
     hub.spawn_after(0, self.do_exit)
     return "ok"
 
+  @rest_command
+  def get_reset(self, req, **kw):
+    RyuApp._instance.reset()
+    return "ok"
+
   @rest_command
   def get_clear(self, req, **kw):
     RyuApp._instance.clear_switch()
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import subprocess
 from pathlib import Path, PosixPath
 
 import find_mod
@@ -34,3 +35,9 @@ class SUT(Base):
             cmd.append(self.virtualenv)
         self.run_async_ssh_cmd(cmd)
         self.wait_for_callback()
+
+    def reset(self):
+        r = self.run_ssh_cmd(['curl', '-s', '-f', '-o', '/dev/null',
+                              'http://localhost:8080/tipsy/reset'],
+                             stderr=subprocess.DEVNULL, check=False)
+        return r.returncode == 0
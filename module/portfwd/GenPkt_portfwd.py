@@ -17,23 +17,28 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import random
-from scapy.all import *
+from pkt_hdr import *
 
 from gen_pcap_base import GenPkt as Base
-from gen_pcap_base import byte_seq
+from gen_pcap_base import byte_seq_int
 
 
 
 class GenPkt(Base):
+    use_template = True
 
     def get_auto_pkt_num(self):
         return 1024
 
-    def gen_pkt(self, pkt_idx):
-        smac = byte_seq('aa:bb:bb:aa:%02x:%02x', random.randrange(1, 65023))
-        dmac = byte_seq('aa:cc:dd:cc:%02x:%02x', random.randrange(1, 65023))
-        dip = byte_seq('3.3.%d.%d', random.randrange(1, 255))
-        p = Ether(dst=dmac, src=smac) / IP(dst=dip)
-        p = self.add_payload(p, self.args.pkt_size)
-        return p
+    def gen_template(self, key):
+        fields = {'smac': 'Ether.src', 'dmac': 'Ether.dst', 'dip': 'IP.dst'}
+        return Ether() / IP(), fields
+
+    def gen_fields_batch(self, pkt_idxs):
+        n = len(pkt_idxs)
+        rng = self.rng
+        smac = byte_seq_int(0xaabbbbaa0000, rng.randint(1, 65023, size=n))
+        dmac = byte_seq_int(0xaaccddcc0000, rng.randint(1, 65023, size=n))
+        dip = byte_seq_int(0x03030000, rng.randint(1, 255, size=n))
+        return [(None, slice(None), n,
+                 {'smac': smac, 'dmac': dmac, 'dip': dip})]
@@ -62,7 +62,11 @@ class SUT(object):
         src_dir = Path().cwd()
         dst_dir = Path(dst_dir)
 
-        for fname in ['pipeline.json', 'benchmark.json']:
+        fnames = ['pipeline.json', 'benchmark.json']
+        if (src_dir / 'pipeline.json.tables.npz').exists():
+            # Columnar tables of pipeline.json
+            fnames.append('pipeline.json.tables.npz')
+        for fname in fnames:
             self.upload_to_remote(src_dir / fname, dst_dir / fname)
 
     def start(self, *args):
@@ -76,7 +80,8 @@ class SUT(object):
     def _start(self, *args):
         raise NotImplementedError
 
-    def stop(self, *args):
+    def query_result(self):
+        "Update self.result with the result reported by the running SUT"
         r = self.run_ssh_cmd(['curl', '-s', '-o', '-',
                               'http://localhost:8080/tipsy/result'],
                              stdout=subprocess.PIPE, stderr=None, check=False)
@@ -87,6 +92,33 @@ class SUT(object):
                 data = {'error': str(e)}
             self.result.update(**data)
 
+    def reset(self):
+        """Prepare the running SUT for the next measurement (warm-SUT
+        mode): restart its run-time tasks and reset its counters.
+        Return False if the SUT does not support this, then it has to be
+        restarted instead."""
+        return False
+
+    def signal_runner(self, runner):
+        """Send SIGUSR1 to the `runner` script running on the SUT, and
+        wait until it calls back.  Return True on success."""
+        wait = Path(self.conf.sut.tipsy_dir) / 'lib' / 'wait_for_callback.py'
+        # Match only the python process, not the shells having `runner`
+        # in their command lines (e.g., this one)
+        pattern = '^[^ ]*python[0-9.]* [^ ]*%s' % runner.replace('.', '[.]')
+        cmd = ("timeout 60 %s & sleep 1; pkill -USR1 -f '%s' || kill $!; "
+               "wait $!" % (wait, pattern))
+        return self.run_ssh_cmd([cmd], check=False).returncode == 0
+
+    def is_running(self):
+        "Is the screen session of the SUT still running?"
+        cmd = ['screen', '-ls', self.screen_name]
+        return subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT).returncode == 0
+
+    def stop(self, *args):
+        self.query_result()
+
         cmd = ['screen', '-S', self.screen_name, '-X', 'stuff', '^C']
         subprocess.run(cmd, check=True)
 
@@ -43,4 +43,7 @@ class SUT(Base):
         self.run_async_ssh_cmd([str(c) for c in cmd])
         self.wait_for_callback()
 
+    def reset(self):
+        return self.signal_runner('bess-runner.py')
+
 
@@ -42,3 +42,6 @@ class SUT(Base):
         dpdk_version = fline.split('DPDK')[-1].strip()
         self.result['versions'] = {}
         self.result['versions']['DPDK'] = dpdk_version
+
+    def reset(self):
+        return self.signal_runner('vpp-runner.py')
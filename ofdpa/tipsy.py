@@ -45,6 +45,8 @@ import subprocess
 import sys
 
 sys.path.append('/usr/bin')
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'lib'))
+import conf_tables
 from OFDPA_python import *
 
 pl_conf_file = '/tmp/pipeline.json'
@@ -492,8 +494,8 @@ class PL_l3fwd(PL):
         fe.flowData.unicastRoutingFlowEntry.groupID = group_id
         mc = fe.flowData.unicastRoutingFlowEntry.match_criteria
         mc.etherType = 0x0800
-        mc.dstIp4 = self.ip_to_int(str(entry.ip))
         mc.dstIp4Mask = self.ip_prefix_to_int(entry.prefix_len)
+        mc.dstIp4 = self.ip_to_int(str(entry.ip)) & mc.dstIp4Mask
         ofdpaFlowAdd(fe)
 
     def ip_to_int(self, address):
@@ -526,7 +528,7 @@ class Tipsy(object):
         try:
             with open(conf_file, 'r') as f:
                 conv_fn = lambda d: ObjectView(**d)
-                conf = json.load(f, object_hook=conv_fn)
+                conf = conf_tables.load(f, object_hook=conv_fn)
                 return conf
         except IOError as e:
             print('Failed to load cfg file (%s): %s' % (conf_file, e))
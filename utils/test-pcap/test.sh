@@ -1,5 +1,8 @@
 #!/bin/bash
 
+# Regression checks of the cache of the generated files
+./check-cache || exit 1
+
 gen_conf=../../lib/gen_conf.py
 gen_pcap=../../lib/gen_pcap.py
 classbench=../../../classbench-ng/classbench
@@ -22,4 +25,14 @@ for pl in $pipelines; do
     $gen_pcap $e2 -d uplink -c pipeline-$pl.json -o t-$pl-u.pcap
     $gen_pcap $e2 -d downlink -c pipeline-$pl.json -o t-$pl-d.pcap
     time $gen_pcap $e2 -t 0 -n 10000 -c pipeline-$pl.json -o t-$pl.pcap
+    # Regression check: generation time must be linear in pkt-num
+    ./check-scaling -- $gen_pcap $e2 -n {n} -c pipeline-$pl.json -o t-$pl-s.pcap
+done
+
+# Regression check: the run-time behaviour (fluctuating entries) must be
+# generated in linear time
+for args in "l2fwd --fluct-table {n}" "l3fwd --fluct-l3-table {n}" \
+            "mgw --fluct-user {n} --fluct-server {n}"; do
+    ./check-scaling -s 125000 250000 500000 1000000 -- \
+      $gen_conf -p $args -o /dev/null
 done
@@ -16,8 +16,13 @@ apt-get install --yes \
     ssh \
     python-pip \
     python-dev \
+    python3-pip \
+    python3-dev \
     python3-jsonschema \
     python3-matplotlib \
+    python3-numpy \
+    zstd \
+    liblz4-tool \
     libffi-dev \
     libssl-dev \
     libtbb2 \
@@ -30,7 +35,10 @@ apt-get install --yes \
 
 
 # scapy 2.2 in "Ubuntu 16.04.4 LTS, xenial" does not support VXLAN
-pip install scapy
+# gen_pcap runs on python3, scapy is only needed for its --ascii output
+pip3 install scapy
+# Optional codecs of the compressed pcaps (traffic.compression)
+pip3 install zstandard lz4
 
 echo 192.168.53.3 sut.local >> /etc/hosts
 
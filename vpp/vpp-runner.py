@@ -19,14 +19,17 @@
 
 import argparse
 import json
-import re
 import requests
 import signal
 import subprocess
 import sys
 import time
+from pathlib import Path
 from tempfile import NamedTemporaryFile
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'lib'))
+import conf_tables
+
 
 class PL(object):
     def __init__(self, plconf, bmconf):
@@ -36,6 +39,8 @@ class PL(object):
         self.uplink_if = self.bmconf.sut.uplink_vpp_interface
         self.downlink_if = self.bmconf.sut.downlink_vpp_interface
         self._running = False
+        self._reset = False
+        self.on_reset = None
 
     def init(self):
         raise NotImplementedError
@@ -48,9 +53,27 @@ class PL(object):
     def stop(self):
         self._running = False
 
+    def reset(self):
+        "Restart the run-time tasks and reset the counters"
+        self._reset = True
+
+    def handle_reset(self):
+        """Called between the rounds of the run-time tasks: if a reset
+        has been requested, clear the counters of VPP, and the next
+        round starts the run-time tasks of the next measurement
+        (warm-SUT mode)"""
+        if not self._reset:
+            return
+        self._reset = False
+        for counters in ('interfaces', 'runtime', 'errors'):
+            subprocess.call(['sudo', 'vppctl', 'clear', counters])
+        if self.on_reset:
+            self.on_reset()
+
     def _run(self):
         table_actions = ('mod_l3_table', 'mod_group_table')
         while self._running:
+            self.handle_reset()
             for task in self.plconf.run_time:
                 if not self._running:
                     return
@@ -85,6 +108,7 @@ class PL_portfwd(PL):
 
     def _run(self):
         while self._running:
+            self.handle_reset()
             time.sleep(self.runtime_interval)
 
 
@@ -102,7 +126,7 @@ class PL_l3fwd(PL):
             cmds.append('set int ip address %s %s' % params)
 
         for entry in self.plconf.upstream_l3_table:
-            ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+            ip = conf_tables.ip_prefix(entry.ip, entry.prefix_len)
             route_params = (ip, entry.prefix_len, self.uplink_if)
             cmds.append('ip route add %s/%d via %s' % route_params)
             arp_params = (self.uplink_if, entry.ip,
@@ -110,7 +134,7 @@ class PL_l3fwd(PL):
             cmds.append('set ip arp %s %s %s' % arp_params)
 
         for entry in self.plconf.downstream_l3_table:
-            ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+            ip = conf_tables.ip_prefix(entry.ip, entry.prefix_len)
             route_params = (ip, entry.prefix_len, self.downlink_if)
             cmds.append('ip route add %s/%d via %s' % route_params)
             arp_params = (self.downlink_if, entry.ip,
@@ -143,7 +167,7 @@ class PL_l3fwd(PL):
         arp_template = 'sudo vppctl set ip arp %s %s %s %s'
         interface = {'upstream': self.uplink_if,
                      'downstream': self.downlink_if}[table]
-        ip = re.sub(r'\.[^.]+$', '.0', entry.ip)
+        ip = conf_tables.ip_prefix(entry.ip, entry.prefix_len)
         route_params = (cmd, ip, entry.prefix_len, interface)
         if cmd == 'add':
             cmd = ''
@@ -233,6 +257,7 @@ class VPP(object):
         pl = getattr(sys.modules[__name__],
                      'PL_%s' % self.plconf.name)
         self.pipeline = pl(self.plconf, self.bmconf)
+        self.pipeline.on_reset = self.call_configured_webhook
         self.pipeline.init()
         self.call_configured_webhook()
         self.pipeline.start()
@@ -265,6 +290,11 @@ def signal_handler(signum, frame):
     vpp.stop()
 
 
+def reset_handler(signum, frame):
+    if vpp.pipeline:
+        vpp.pipeline.reset()
+
+
 def call_cmd(cmd):
     print(' '.join(cmd))
     return subprocess.run(cmd, check=True)
@@ -282,7 +312,7 @@ if __name__ == '__main__':
 
     try:
         def conv_fn(d): return ObjectView(**d)
-        plconf = json.load(args.pl_conf, object_hook=conv_fn)
+        plconf = conf_tables.load(args.pl_conf, object_hook=conv_fn)
         bmconf = json.load(args.bm_conf, object_hook=conv_fn)
     except:
         raise
@@ -290,5 +320,6 @@ if __name__ == '__main__':
     vpp = VPP(plconf, bmconf)
 
     signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGUSR1, reset_handler)
 
     vpp.start()